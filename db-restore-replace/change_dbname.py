@@ -1,5 +1,8 @@
+import time
 import pandas as pd
 import psycopg2
+from psycopg2 import errorcodes
+from schema_catalog import load_schema_catalog
 
 # CSV 파일 읽기
 csv_file = "path/table_list.csv"  # CSV 파일 경로
@@ -11,6 +14,17 @@ dbname = 'database'
 user = 'user'
 password = 'password'
 
+# 이름 변경 방식
+# 'bulk': 여러 테이블의 잠금을 lock_timeout으로 먼저 잡은 뒤 한 트랜잭션에서 한 번에 이름 변경
+#         (잠금을 못 잡으면 롤백 후 대기 시간을 늘려 가며 재시도, 운영 중 교체 시간이 수 밀리초로 줄어듦)
+# 'table': 테이블마다 트랜잭션을 나눠 이름 변경
+rename_mode = 'bulk'
+batch_size = 0  # bulk 모드에서 한 트랜잭션에 묶을 테이블 수 (0이면 전체를 한 트랜잭션으로 처리)
+lock_timeout_ms = 2000  # 잠금 하나의 대기 최대 시간
+lock_total_timeout_ms = 2000  # 묶음 전체 잠금(LOCK TABLE 문 하나)의 대기 최대 시간
+max_retries = 5  # 잠금을 못 잡았을 때 재시도 횟수
+retry_backoff_sec = 1.0  # 첫 재시도 대기 시간 (재시도마다 2배)
+
 # PostgreSQL 연결
 conn = psycopg2.connect(host=host, dbname=dbname, user=user, password=password)
 cur = conn.cursor()
@@ -19,34 +33,96 @@ cur = conn.cursor()
 successful_tables = 0  # 성공적으로 이름이 변경된 테이블 수
 failed_tables = []  # 실패한 테이블 목록
 
+renames = []
 for index, row in df.iterrows():
     schema_name = row.iloc[0]  # 첫 번째 열: 스키마 이름
     table_name = row.iloc[1]   # 두 번째 열: 테이블 이름
     # 새로운 테이블 이름 생성
     new_table_name = f"{table_name}_back0115"
-    
-    try:
-        # 트랜잭션을 시작합니다.
-        conn.autocommit = False  # 자동 커밋을 비활성화하여 명시적인 트랜잭션을 사용할 수 있게 합니다.
-        
-        # 테이블 이름 변경 쿼리
-        query = f"""
-        ALTER TABLE {schema_name}.{table_name} RENAME TO {new_table_name};
-        """
-        cur.execute(query)
-        conn.commit()  # 트랜잭션 커밋
-        successful_tables += 1  # 성공적인 테이블 카운트 증가
-        print(f"Table {schema_name}.{table_name} renamed to {new_table_name}.")
-        
-    except Exception as e:
-        # 오류 발생 시 롤백하고, 실패한 테이블 목록에 추가
-        conn.rollback()  # 오류가 발생하면 롤백하여 트랜잭션을 되돌립니다.
-        failed_tables.append(f"{schema_name}.{table_name}")  # 실패한 테이블 추가
-        print(f"Error renaming {schema_name}.{table_name}: {e}")
-    
-    finally:
-        # 각 테이블 작업 후 트랜잭션을 다시 활성화하여 계속 진행할 수 있도록 합니다.
-        conn.autocommit = True  # 자동 커밋을 다시 활성화
+    renames.append((schema_name, table_name, new_table_name))
+
+# 테이블마다 트랜잭션을 나눠 이름 변경
+def rename_tables_one_by_one():
+    global successful_tables
+    for schema_name, table_name, new_table_name in renames:
+        try:
+            # 트랜잭션을 시작합니다.
+            conn.autocommit = False  # 자동 커밋을 비활성화하여 명시적인 트랜잭션을 사용할 수 있게 합니다.
+
+            # 테이블 이름 변경 쿼리
+            query = f"""
+            ALTER TABLE {schema_name}.{table_name} RENAME TO {new_table_name};
+            """
+            cur.execute(query)
+            conn.commit()  # 트랜잭션 커밋
+            successful_tables += 1  # 성공적인 테이블 카운트 증가
+            print(f"Table {schema_name}.{table_name} renamed to {new_table_name}.")
+
+        except Exception as e:
+            # 오류 발생 시 롤백하고, 실패한 테이블 목록에 추가
+            conn.rollback()  # 오류가 발생하면 롤백하여 트랜잭션을 되돌립니다.
+            failed_tables.append(f"{schema_name}.{table_name}")  # 실패한 테이블 추가
+            print(f"Error renaming {schema_name}.{table_name}: {e}")
+
+        finally:
+            # 각 테이블 작업 후 트랜잭션을 다시 활성화하여 계속 진행할 수 있도록 합니다.
+            conn.autocommit = True  # 자동 커밋을 다시 활성화
+
+# 묶음 하나를 한 트랜잭션에서 이름 변경
+# 모든 테이블의 잠금을 먼저 잡은 뒤 이름을 바꾸므로, 잠금이 잡힌 뒤에는 ALTER만 실행되어 즉시 커밋됨
+# lock_timeout은 잠금 하나마다 따로 적용되어 LOCK TABLE 문 하나가 (테이블 수 × lock_timeout_ms) 동안
+# 이미 잡은 잠금을 쥔 채 기다릴 수 있으므로, statement_timeout으로 잠금 문 전체의 대기 시간도 제한
+def rename_batch(batch):
+    global successful_tables
+    table_list = ", ".join(f"{schema_name}.{table_name}" for schema_name, table_name, _ in batch)
+    for attempt in range(max_retries + 1):
+        try:
+            cur.execute(f"SET LOCAL lock_timeout = '{lock_timeout_ms}ms';")
+            cur.execute(f"SET LOCAL statement_timeout = '{lock_total_timeout_ms}ms';")
+            cur.execute(f"LOCK TABLE {table_list} IN ACCESS EXCLUSIVE MODE;")
+            cur.execute("SET LOCAL statement_timeout TO DEFAULT;")
+            started = time.perf_counter()
+            for schema_name, table_name, new_table_name in batch:
+                cur.execute(f"ALTER TABLE {schema_name}.{table_name} RENAME TO {new_table_name};")
+            conn.commit()
+            successful_tables += len(batch)
+            print(f"Renamed {len(batch)} tables in one transaction ({(time.perf_counter() - started) * 1000:.1f} ms after locking).")
+            return
+        except psycopg2.Error as e:
+            conn.rollback()
+            # 잠금 하나의 대기 초과는 LOCK_NOT_AVAILABLE, 잠금 문 전체의 대기 초과는 QUERY_CANCELED
+            if e.pgcode in (errorcodes.LOCK_NOT_AVAILABLE, errorcodes.QUERY_CANCELED) and attempt < max_retries:
+                wait_sec = retry_backoff_sec * (2 ** attempt)
+                print(f"Lock not available (attempt {attempt + 1}/{max_retries + 1}), retrying in {wait_sec:.1f}s")
+                time.sleep(wait_sec)
+                continue
+            failed_tables.extend(f"{schema_name}.{table_name}" for schema_name, table_name, _ in batch)
+            print(f"Error renaming batch ({table_list}): {e}")
+            return
+
+# 카탈로그를 한 번 조회하여 원본이 없거나 새 이름이 이미 있는 테이블은 미리 제외한 뒤 묶음 단위로 이름 변경
+def rename_tables_bulk():
+    catalog = load_schema_catalog(conn, [(schema_name, table_name) for schema_name, table_name, _ in renames]
+                                  + [(schema_name, new_table_name) for schema_name, _, new_table_name in renames])
+    valid_renames = []
+    for schema_name, table_name, new_table_name in renames:
+        if not catalog[f"{schema_name}.{table_name}"]['exists']:
+            failed_tables.append(f"{schema_name}.{table_name}")
+            print(f"Error renaming {schema_name}.{table_name}: table does not exist")
+        elif catalog[f"{schema_name}.{new_table_name}"]['exists']:
+            failed_tables.append(f"{schema_name}.{table_name}")
+            print(f"Error renaming {schema_name}.{table_name}: {new_table_name} already exists")
+        else:
+            valid_renames.append((schema_name, table_name, new_table_name))
+
+    size = batch_size or len(valid_renames)
+    for i in range(0, len(valid_renames), max(size, 1)):
+        rename_batch(valid_renames[i:i + size])
+
+if rename_mode == 'bulk':
+    rename_tables_bulk()
+else:
+    rename_tables_one_by_one()
 
 # 결과 출력
 print(f"\nTotal successful table renames: {successful_tables}")
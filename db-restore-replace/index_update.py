@@ -1,6 +1,9 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
+import threading
 from datetime import datetime
 import os
 # PostgreSQL 연결 설정
@@ -17,12 +20,21 @@ DB_SETTINGS = {
 current_date = datetime.now().strftime('%Y%m%d')
 txt_log_file_name = f"sequence_update_{current_date}.txt"
 error_log_file_name = f"sequence_update_error_{current_date}.txt"
+plan_log_file_name = f"sequence_update_plan_{current_date}.txt"
 
 # 스키마 배열
 SCHEMAS = [
    "schema"
 ]
 
+# 시퀀스 재설정 방식
+# 'batch': pg_depend로 시퀀스 소유 관계(serial, identity 컬럼 포함)를 찾아 스키마별 쿼리 한 번으로 재설정
+# 'parallel': 모든 스키마의 시퀀스를 연결 풀에서 병렬로 재설정 (인덱스로 MAX()를 구할 수 없는 테이블부터 실행)
+# 'legacy': 시퀀스마다 last_value, MAX(), setval을 각각 실행
+RESYNC_MODE = 'batch'
+MAX_WORKERS = 8  # parallel 모드 동시 실행 연결 수
+DRY_RUN = False  # True면 RESYNC_MODE와 관계없이 setval 없이 테이블별 예상 비용 보고서(plan_log_file_name)만 작성
+
 # 시퀀스 및 테이블 정보 쿼리 템플릿
 SEQUENCE_QUERY_TEMPLATE = """
 SELECT 
@@ -91,6 +103,251 @@ BEGIN
 END $$;
 """
 
+# 스키마 하나의 모든 시퀀스를 서버에서 한 번에 재설정하는 쿼리 (PostgreSQL 12 이상)
+# - 소유 관계는 pg_depend(deptype 'a': serial/OWNED BY, 'i': identity)로 직접 조회하여 LIKE 조인을 없앰
+# - MAX()는 query_to_xml로 테이블마다 동적 실행
+# - 결과는 시퀀스별 변경 전/후 값을 한 결과 집합으로 반환 (MAX가 NULL이면 setval을 건너뜀)
+BATCH_RESYNC_QUERY = """
+WITH owned AS MATERIALIZED (
+    SELECT
+        n.nspname AS schema_name,
+        t.relname AS table_name,
+        a.attname AS column_name,
+        s.relname AS sequence_name,
+        s.oid AS sequence_oid,
+        sq.last_value AS before_value
+    FROM pg_depend d
+    JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+    JOIN pg_namespace sn ON sn.oid = s.relnamespace
+    JOIN pg_class t ON t.oid = d.refobjid AND t.relkind IN ('r', 'p')
+    JOIN pg_namespace n ON n.oid = t.relnamespace
+    JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+    LEFT JOIN pg_sequences sq ON sq.schemaname = sn.nspname AND sq.sequencename = s.relname
+    WHERE d.classid = 'pg_class'::regclass
+      AND d.refclassid = 'pg_class'::regclass
+      AND d.deptype IN ('a', 'i')
+      AND n.nspname = %(schema_name)s
+),
+next_values AS MATERIALIZED (
+    SELECT
+        o.*,
+        (xpath('/row/next_value/text()', query_to_xml(
+            format('SELECT MAX(%%I) + 1 AS next_value FROM %%I.%%I', o.column_name, o.schema_name, o.table_name),
+            true, true, '')))[1]::text::bigint AS next_value
+    FROM owned o
+)
+SELECT
+    schema_name,
+    table_name,
+    column_name,
+    sequence_name,
+    before_value,
+    next_value,
+    CASE WHEN next_value IS NOT NULL THEN setval(sequence_oid, next_value, true) END AS after_value
+FROM next_values
+ORDER BY table_name, column_name;
+"""
+
+# parallel 모드 작업 목록 조회 쿼리 (모든 스키마를 한 번에 조회)
+# has_btree_index: 해당 컬럼이 첫 번째 키인 일반 btree 인덱스가 있으면 MAX()를 인덱스 끝에서 바로 읽을 수 있음
+SEQUENCE_PLAN_QUERY = """
+SELECT
+    n.nspname AS schema_name,
+    t.relname AS table_name,
+    a.attname AS column_name,
+    s.relname AS sequence_name,
+    sn.nspname AS sequence_schema,
+    sq.last_value AS before_value,
+    t.relpages,
+    EXISTS (
+        SELECT 1
+        FROM pg_index x
+        JOIN pg_class ic ON ic.oid = x.indexrelid
+        JOIN pg_am am ON am.oid = ic.relam
+        WHERE x.indrelid = t.oid
+          AND am.amname = 'btree'
+          AND x.indkey[0] = a.attnum
+          AND x.indpred IS NULL
+          AND x.indisvalid
+    ) AS has_btree_index
+FROM pg_depend d
+JOIN pg_class s ON s.oid = d.objid AND s.relkind = 'S'
+JOIN pg_namespace sn ON sn.oid = s.relnamespace
+JOIN pg_class t ON t.oid = d.refobjid AND t.relkind IN ('r', 'p')
+JOIN pg_namespace n ON n.oid = t.relnamespace
+JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = d.refobjsubid
+LEFT JOIN pg_sequences sq ON sq.schemaname = sn.nspname AND sq.sequencename = s.relname
+WHERE d.classid = 'pg_class'::regclass
+  AND d.refclassid = 'pg_class'::regclass
+  AND d.deptype IN ('a', 'i')
+  AND n.nspname = ANY(%(schemas)s);
+"""
+
+# 로그 파일에 여러 스레드가 동시에 쓰지 않도록 하는 락
+log_lock = threading.Lock()
+
+def write_log(log_file, message):
+    with log_lock:
+        log_file.write(message + "\n")
+        print(message)  # 콘솔에도 출력
+
+# 시퀀스 하나를 재설정 (MAX() 계산과 setval을 한 문장으로 실행, MAX가 NULL이면 결과 행 없음)
+def resync_sequence(pool, task):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f'SELECT setval(%s::regclass, m.max_value + 1, true) '
+                f'FROM (SELECT MAX("{task["column_name"]}") AS max_value FROM "{task["schema_name"]}"."{task["table_name"]}") m '
+                f'WHERE m.max_value IS NOT NULL',
+                (f'"{task["sequence_schema"]}"."{task["sequence_name"]}"',))
+            row = cur.fetchone()
+        conn.commit()
+        return row[0] if row else None
+    finally:
+        pool.putconn(conn)
+
+# MAX() 실행 계획의 예상 비용 조회 (DRY_RUN용)
+def explain_max(pool, task):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f'EXPLAIN (FORMAT JSON) SELECT MAX("{task["column_name"]}") FROM "{task["schema_name"]}"."{task["table_name"]}"')
+            plan = cur.fetchone()[0][0]['Plan']
+        conn.commit()
+        return plan['Total Cost']
+    finally:
+        pool.putconn(conn)
+
+# 모든 스키마의 시퀀스 작업 목록 조회 (인덱스를 쓸 수 없어 전체 스캔이 필요한 큰 테이블부터 정렬)
+def fetch_sequence_tasks(pool):
+    conn = pool.getconn()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(SEQUENCE_PLAN_QUERY, {'schemas': SCHEMAS})
+            tasks = cur.fetchall()
+        conn.commit()
+    finally:
+        pool.putconn(conn)
+    for task in tasks:
+        task['relpages'] = task['relpages'] or 0
+    tasks.sort(key=lambda task: (task['has_btree_index'], -task['relpages']))
+    scan_count = sum(1 for task in tasks if not task['has_btree_index'])
+    print(f"Found {len(tasks)} sequences in {len(SCHEMAS)} schemas ({scan_count} require a table scan)")
+    return tasks
+
+# DRY_RUN: setval 없이 시퀀스별 MAX() 예상 비용 보고서만 작성 (모든 RESYNC_MODE 공통)
+# 같은 날 실제 재설정 로그를 덮어쓰지 않도록 plan_log_file_name에만 기록 (오류도 같은 파일에 기록)
+def execute_dry_run():
+    try:
+        with open(plan_log_file_name, 'w', encoding='utf-8') as plan_log_file:
+            pool = ThreadedConnectionPool(1, MAX_WORKERS, **DB_SETTINGS)
+            try:
+                tasks = fetch_sequence_tasks(pool)
+                costs = {}
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                    future_to_task = {executor.submit(explain_max, pool, task): task for task in tasks}
+                    for future in as_completed(future_to_task):
+                        task = future_to_task[future]
+                        try:
+                            costs[id(task)] = future.result()
+                        except Exception as e:
+                            write_log(plan_log_file, f"Error explaining {task['schema_name']}.{task['table_name']}\nError: {e}\n")
+                # 실행 순서대로 보고서 작성
+                for task in tasks:
+                    write_log(plan_log_file, (
+                        f"Schema: {task['schema_name']}, Table: {task['table_name']}, Sequence: {task['sequence_name']}, "
+                        f"Index: {'btree' if task['has_btree_index'] else 'none (table scan)'}, "
+                        f"Pages: {task['relpages']}, Estimated cost: {costs.get(id(task))}"
+                    ))
+            finally:
+                pool.closeall()
+
+    except psycopg2.Error as e:
+        error_message = f"Error connecting to the database: {e}"
+        with open(plan_log_file_name, 'a', encoding='utf-8') as plan_log_file:
+            plan_log_file.write(error_message + "\n")
+        print(error_message)  # 콘솔에도 출력
+
+# 모든 스키마의 시퀀스를 MAX_WORKERS개의 연결에서 병렬로 재설정
+# 인덱스를 쓸 수 없어 전체 스캔이 필요한 테이블을 큰 것부터 먼저 시작하여 전체 소요 시간을 줄임
+def execute_parallel_resync():
+    try:
+        with open(txt_log_file_name, 'w', encoding='utf-8') as log_file, open(error_log_file_name, 'w', encoding='utf-8') as error_log_file:
+            pool = ThreadedConnectionPool(1, MAX_WORKERS, **DB_SETTINGS)
+            try:
+                tasks = fetch_sequence_tasks(pool)
+
+                with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                    future_to_task = {executor.submit(resync_sequence, pool, task): task for task in tasks}
+                    for future in as_completed(future_to_task):
+                        task = future_to_task[future]
+                        try:
+                            after_value = future.result()
+                            if after_value is not None:
+                                write_log(log_file, (
+                                    f"Schema: {task['schema_name']}, Table: {task['table_name']}, Sequence: {task['sequence_name']}\n"
+                                    f"Before: {task['before_value']}, After: {after_value}\n"
+                                ))
+                            else:
+                                write_log(error_log_file, (
+                                    f"Schema: {task['schema_name']}, Table: {task['table_name']}, Sequence: {task['sequence_name']}\n"
+                                    f"Error: next_index_value is None, skipping setval.\n"
+                                ))
+                        except Exception as e:
+                            write_log(error_log_file, (
+                                f"Error in Schema: {task['schema_name']}, Table: {task['table_name']}, Sequence: {task['sequence_name']}\n"
+                                f"Error: {e}\n"
+                            ))
+            finally:
+                pool.closeall()
+
+    except psycopg2.Error as e:
+        error_message = f"Error connecting to the database: {e}"
+        with open(error_log_file_name, 'a', encoding='utf-8') as error_log_file:
+            error_log_file.write(error_message + "\n")
+        print(error_message)  # 콘솔에도 출력
+
+# 스키마별로 쿼리 한 번씩 실행하여 모든 시퀀스를 재설정
+def execute_batch_resync():
+    try:
+        with open(txt_log_file_name, 'w', encoding='utf-8') as log_file, open(error_log_file_name, 'w', encoding='utf-8') as error_log_file:
+            with psycopg2.connect(**DB_SETTINGS) as conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    for schema_name in SCHEMAS:
+                        try:
+                            cur.execute(BATCH_RESYNC_QUERY, {'schema_name': schema_name})
+                            results = cur.fetchall()
+                            conn.commit()
+                        except Exception as e:
+                            conn.rollback()
+                            error_message = f"Error processing schema: {schema_name}\nError: {e}\n"
+                            error_log_file.write(error_message + "\n")
+                            print(error_message)  # 콘솔에도 출력
+                            continue
+
+                        for row in results:
+                            if row['after_value'] is not None:
+                                log_message = (
+                                    f"Schema: {schema_name}, Table: {row['table_name']}, Sequence: {row['sequence_name']}\n"
+                                    f"Before: {row['before_value']}, After: {row['next_value']}\n"
+                                )
+                                log_file.write(log_message + "\n")  # 파일에 기록
+                                print(log_message)  # 콘솔에도 출력
+                            else:
+                                error_message = (
+                                    f"Schema: {schema_name}, Table: {row['table_name']}, Sequence: {row['sequence_name']}\n"
+                                    f"Error: next_index_value is None, skipping setval.\n"
+                                )
+                                error_log_file.write(error_message + "\n")
+                                print(error_message)  # 콘솔에도 출력
+
+    except psycopg2.Error as e:
+        error_message = f"Error connecting to the database: {e}"
+        with open(error_log_file_name, 'a', encoding='utf-8') as error_log_file:
+            error_log_file.write(error_message + "\n")
+        print(error_message)  # 콘솔에도 출력
+
 def execute_do_blocks():
     try:
         # 로그 파일 열기
@@ -156,4 +413,11 @@ def execute_do_blocks():
         print(error_message)  # 콘솔에도 출력
 
 if __name__ == "__main__":
-    execute_do_blocks()
\ No newline at end of file
+    if DRY_RUN:
+        execute_dry_run()
+    elif RESYNC_MODE == 'batch':
+        execute_batch_resync()
+    elif RESYNC_MODE == 'parallel':
+        execute_parallel_resync()
+    else:
+        execute_do_blocks()
\ No newline at end of file
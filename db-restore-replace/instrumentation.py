@@ -0,0 +1,240 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil  # 있으면 현재 RSS를 정확히 측정
+except ImportError:
+    psutil = None
+
+try:
+    import resource  # Windows에는 없음
+except ImportError:
+    resource = None
+
+# ---------------------------
+# 테이블/단계별 소요 시간, 처리량, 최대 메모리를 기록하는 모듈
+# move_table.py, restore_db.py, show_two_table_data_count.py에서 공통으로 사용
+# 테이블 하나가 끝날 때마다 JSON lines 파일에 한 줄씩 추가하고, 실행이 끝나면 Prometheus textfile을 씀
+# ---------------------------
+
+# 단계 이름 (introspect: 카탈로그/TOC 조회, ddl: 테이블 생성, data: 데이터 적재, index: 인덱스/제약조건, verify: 검증)
+PHASES = ('introspect', 'ddl', 'data', 'index', 'verify')
+
+metrics_lock = threading.Lock()
+run_state = {
+    'tool': None,
+    'run_id': None,
+    'started': None,
+    'jsonl_file': None,
+    'prom_file': None,
+    'phases': {},  # 테이블에 속하지 않는 단계 (예: TOC 조회, pre-data 일괄 복원)
+    'peak_rss_mb': 0,
+}
+# {"schema.table": {"phases": {단계: 초}, "rows": 행 수, "bytes": 바이트, "peak_rss_mb": MB, "status": ...}}
+table_metrics = {}
+
+# 현재 프로세스 메모리 사용량 (MB), psutil이 없으면 None
+# 메모리 상한 적용은 이 값만 사용 (줄어들 수 있는 현재 값이어야 함)
+def current_rss_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    return None
+
+# 기록용 메모리 사용량 (MB)
+# psutil이 없으면 resource의 ru_maxrss(지금까지의 최대값, 줄어들지 않음)로 대체, 둘 다 없으면 None (Windows)
+def reported_rss_mb():
+    rss = current_rss_mb()
+    if rss is not None or resource is None:
+        return rss
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux는 KB, macOS는 바이트 단위
+    return max_rss / (1024 * 1024) if sys.platform == 'darwin' else max_rss / 1024
+
+# 실행 시작 시 한 번 호출 (jsonl_file/prom_file이 None이면 해당 출력은 생략)
+def start_run(tool, jsonl_file=None, prom_file=None):
+    with metrics_lock:
+        run_state.update(tool=tool, run_id=datetime.now().strftime('%Y%m%d%H%M%S'), started=time.time(),
+                         jsonl_file=jsonl_file, prom_file=prom_file, phases={}, peak_rss_mb=0)
+        table_metrics.clear()
+
+def table_entry(table_key):
+    if table_key not in table_metrics:
+        table_metrics[table_key] = {'phases': {}, 'rows': None, 'bytes': None, 'peak_rss_mb': 0, 'status': None}
+    return table_metrics[table_key]
+
+# RSS를 측정하여 테이블/실행 전체의 최대값 갱신 (스레드가 프로세스를 공유하므로 값은 프로세스 전체 기준)
+def sample_rss(table_key=None):
+    rss = reported_rss_mb()
+    if rss is None:
+        return None
+    with metrics_lock:
+        run_state['peak_rss_mb'] = max(run_state['peak_rss_mb'], rss)
+        if table_key is not None:
+            entry = table_entry(table_key)
+            entry['peak_rss_mb'] = max(entry['peak_rss_mb'], rss)
+    return rss
+
+# 단계 소요 시간 누적 (table_key가 None이면 실행 전체 단계로 기록)
+def record_phase(table_key, phase_name, seconds):
+    with metrics_lock:
+        phases = run_state['phases'] if table_key is None else table_entry(table_key)['phases']
+        phases[phase_name] = phases.get(phase_name, 0) + seconds
+
+@contextmanager
+def phase(table_key, phase_name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(table_key, phase_name, time.perf_counter() - started)
+        sample_rss(table_key)
+
+def add_rows(table_key, rows):
+    if rows is None or rows < 0:
+        return
+    with metrics_lock:
+        entry = table_entry(table_key)
+        entry['rows'] = (entry['rows'] or 0) + rows
+
+def add_bytes(table_key, nbytes):
+    if not nbytes:
+        return
+    with metrics_lock:
+        entry = table_entry(table_key)
+        entry['bytes'] = (entry['bytes'] or 0) + nbytes
+
+# COPY 파이프를 지나는 바이트 수를 세는 읽기 래퍼 (copy_expert는 read(size)만 호출)
+class CountingReader:
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.raw.close()
+
+# 처리량은 data 단계 시간 기준 (검증만 하는 스크립트는 verify 단계 기준, 둘 다 없으면 None)
+def throughput(entry):
+    data_seconds = entry['phases'].get('data') or entry['phases'].get('verify')
+    if not data_seconds:
+        return None, None
+    rows_per_sec = entry['rows'] / data_seconds if entry['rows'] is not None else None
+    mb_per_sec = entry['bytes'] / (1024 * 1024) / data_seconds if entry['bytes'] is not None else None
+    return rows_per_sec, mb_per_sec
+
+def append_jsonl(record):
+    if not run_state['jsonl_file']:
+        return
+    with open(run_state['jsonl_file'], 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+# 테이블 하나의 기록을 마감하고 JSON lines에 한 줄 추가
+def finish_table(table_key, status='done'):
+    sample_rss(table_key)
+    with metrics_lock:
+        entry = table_entry(table_key)
+        entry['status'] = status
+        rows_per_sec, mb_per_sec = throughput(entry)
+        append_jsonl({
+            'type': 'table',
+            'tool': run_state['tool'],
+            'run_id': run_state['run_id'],
+            'table': table_key,
+            'status': status,
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'phases': {name: round(seconds, 3) for name, seconds in entry['phases'].items()},
+            'rows': entry['rows'],
+            'bytes': entry['bytes'],
+            'rows_per_sec': round(rows_per_sec, 1) if rows_per_sec is not None else None,
+            'mb_per_sec': round(mb_per_sec, 2) if mb_per_sec is not None else None,
+            'peak_rss_mb': round(entry['peak_rss_mb'], 1),
+        })
+
+def prom_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prom_line(name, labels, value):
+    label_str = ",".join(f'{key}="{prom_label(val)}"' for key, val in labels.items())
+    return f"{name}{{{label_str}}} {value}"
+
+# node_exporter textfile collector 형식으로 저장 (수집 중 반쯤 쓴 파일을 읽지 않도록 임시 파일 후 교체)
+def write_prometheus(duration):
+    tool = run_state['tool']
+    metrics = {
+        'dbtool_run_duration_seconds': ('gauge', 'Total run time', [({'tool': tool}, round(duration, 3))]),
+        'dbtool_run_peak_rss_megabytes': ('gauge', 'Peak process RSS during the run',
+                                          [({'tool': tool}, round(run_state['peak_rss_mb'], 1))]),
+        'dbtool_run_phase_seconds': ('gauge', 'Run-level phase time not tied to one table',
+                                     [({'tool': tool, 'phase': name}, round(seconds, 3))
+                                      for name, seconds in run_state['phases'].items()]),
+        'dbtool_table_phase_seconds': ('gauge', 'Per-table phase time', []),
+        'dbtool_table_rows': ('gauge', 'Rows processed per table', []),
+        'dbtool_table_bytes': ('gauge', 'Bytes processed per table', []),
+        'dbtool_table_rows_per_second': ('gauge', 'Rows per second in the data (or verify) phase', []),
+        'dbtool_table_megabytes_per_second': ('gauge', 'MB per second in the data (or verify) phase', []),
+        'dbtool_table_peak_rss_megabytes': ('gauge', 'Peak process RSS while the table was processed', []),
+        'dbtool_table_success': ('gauge', '1 if the table finished successfully', []),
+    }
+    for table_key, entry in table_metrics.items():
+        labels = {'tool': tool, 'table': table_key}
+        for name, seconds in entry['phases'].items():
+            metrics['dbtool_table_phase_seconds'][2].append(({**labels, 'phase': name}, round(seconds, 3)))
+        rows_per_sec, mb_per_sec = throughput(entry)
+        for metric, value in (('dbtool_table_rows', entry['rows']),
+                              ('dbtool_table_bytes', entry['bytes']),
+                              ('dbtool_table_rows_per_second', rows_per_sec),
+                              ('dbtool_table_megabytes_per_second', mb_per_sec)):
+            if value is not None:
+                metrics[metric][2].append((labels, round(value, 3)))
+        metrics['dbtool_table_peak_rss_megabytes'][2].append((labels, round(entry['peak_rss_mb'], 1)))
+        metrics['dbtool_table_success'][2].append((labels, 1 if entry['status'] == 'done' else 0))
+
+    lines = []
+    for name, (metric_type, help_text, samples) in metrics.items():
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(prom_line(name, labels, value) for labels, value in samples)
+
+    temp_file = f"{run_state['prom_file']}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_file, run_state['prom_file'])
+
+# 실행 종료 시 호출: 테이블별 요약 출력, 실행 요약을 JSON lines에 추가, Prometheus textfile 저장
+def finish_run():
+    sample_rss()
+    duration = time.time() - run_state['started']
+    with metrics_lock:
+        if table_metrics:
+            print("\nTable metrics (seconds per phase, rows/s, MB/s, peak RSS MB):")
+            for table_key, entry in table_metrics.items():
+                rows_per_sec, mb_per_sec = throughput(entry)
+                phases = ", ".join(f"{name} {seconds:.1f}" for name, seconds in entry['phases'].items())
+                print(f"  {table_key}: {phases or '-'}"
+                      f" | {f'{rows_per_sec:,.0f} rows/s' if rows_per_sec is not None else '- rows/s'}"
+                      f" | {f'{mb_per_sec:.1f} MB/s' if mb_per_sec is not None else '- MB/s'}"
+                      f" | {entry['peak_rss_mb']:.0f} MB")
+        append_jsonl({
+            'type': 'run',
+            'tool': run_state['tool'],
+            'run_id': run_state['run_id'],
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+            'duration_sec': round(duration, 3),
+            'phases': {name: round(seconds, 3) for name, seconds in run_state['phases'].items()},
+            'tables': len(table_metrics),
+            'failed_tables': sum(1 for entry in table_metrics.values() if entry['status'] != 'done'),
+            'peak_rss_mb': round(run_state['peak_rss_mb'], 1),
+        })
+        if run_state['prom_file']:
+            write_prometheus(duration)
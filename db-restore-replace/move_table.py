@@ -1,8 +1,20 @@
+import json
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import psycopg2
+from psycopg2.extensions import quote_ident
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from schema_catalog import load_schema_catalog, column_definitions, column_names, integer_pk
+import instrumentation
 
 # CSV 파일 읽기
 csv_file = "C:/문서/UDS/table_list.csv"  # CSV 파일 경로
+failed_csv_file = "C:/문서/UDS/failed_table_list.csv"  # 실패한 테이블 목록 (재실행용, table_list.csv와 같은 형식)
 df = pd.read_csv(csv_file)
 
 # Source DB 접속 정보
@@ -17,125 +29,716 @@ target_dbname = 'database'
 target_user = 'user'
 target_password = 'password'
 
-# Source DB 연결
-source_conn = psycopg2.connect(host=source_host, dbname=source_dbname, user=source_user, password=source_password)
-source_cur = source_conn.cursor()
+# 복사 방식 설정
+# 'stream': Source의 COPY TO STDOUT을 Target의 COPY FROM STDIN으로 바로 연결 (Python 행 객체 없음)
+# 'insert': 기존 방식 (SELECT * + executemany)
+copy_mode = 'stream'
+copy_format = 'binary'  # 'binary' 또는 'text' (binary는 양쪽 서버 메이저 버전이 같을 때만 사용)
+copy_buffer_size = 1024 * 1024  # COPY FROM STDIN 읽기 단위 (바이트)
 
-# Target DB 연결
-target_conn = psycopg2.connect(host=target_host, dbname=target_dbname, user=target_user, password=target_password)
-target_cur = target_conn.cursor()
+# 행 단위 변환이 필요한 테이블 설정 (COPY 파이프 대신 서버 사이드 커서 경로로 복사)
+column_subsets = {}  # 예: {"schema.table": ["id", "name", "geom"]}
+row_transforms = {}  # 예: {"schema.table": lambda row: (row[0], row[1].strip(), row[2])}
+cursor_itersize = 10000  # 서버 사이드 커서에서 한 번에 가져올 행 수
+write_page_size = 1000  # execute_values 한 문장에 담을 행 수
+memory_limit_mb = 1024  # 메모리 상한 (초과 시 가져오는 행 수를 절반으로 줄임, 0이면 제한 없음, psutil 필요)
+min_itersize = 500
+
+# 병렬 복사 설정 (워커마다 Source/Target 연결을 하나씩 풀에서 받아 사용)
+max_workers = 4
+
+# 큰 테이블 하나를 여러 범위로 나눠 병렬 복사하는 설정
+# 범위 워커는 풀과 별도로 연결을 열기 때문에 최대 max_workers * partition_count 개의 연결이 추가로 필요함
+partition_threshold_mb = 2048  # 이 크기(MB) 이상인 테이블은 범위 분할 복사 (0이면 사용 안 함)
+partition_count = 8  # 테이블 하나를 나눌 범위 수 (= 범위 워커 수)
+partition_method = 'pk'  # 'pk': 정수형 단일 PK 범위 (중단 후 남은 범위만 이어서 복사 가능, PK가 없으면 ctid 사용), 'ctid': 페이지 범위 (PostgreSQL 14 이상에서 TID 범위 스캔)
+
+# Target 테이블 적재 방식
+# UNLOGGED로 만들어 WAL 없이 적재한 뒤 인덱스/제약조건 생성, ANALYZE를 거쳐 LOGGED로 전환
+unlogged_load = True
+build_indexes = True  # Source의 PK/UNIQUE 제약조건과 인덱스(GiST 포함)를 Target에 다시 생성 (column_subsets 테이블 제외)
+index_workers = 4  # 인덱스를 동시에 생성할 연결 수
+index_maintenance_work_mem = '1GB'  # 인덱스 생성 연결의 maintenance_work_mem
+
+# 동기화 방식 설정
+# 'full': 테이블 전체를 다시 복사
+# 'delta': 양쪽 테이블을 PK 범위로 나눠 서버에서 범위별 해시를 계산하고, 해시가 다른 범위만 다시 복사
+#          (정수형 단일 PK가 없거나 Target에 테이블이 없으면 전체 복사)
+sync_mode = 'full'
+sync_chunk_size = 100000  # delta 모드에서 해시를 계산할 PK 범위 크기 (키 값 기준)
+
+# 체크포인트 설정 (완료된 테이블과 테이블별 진행 위치를 기록하여 재실행 시 이어서 복사)
+# 모든 테이블이 성공하면 체크포인트 파일은 삭제됨
+checkpoint_file = "C:/문서/UDS/move_table_checkpoint.json"
+resume = True  # False면 기존 체크포인트를 무시하고 처음부터 복사
+
+# 계측 결과 저장 (테이블/단계별 소요 시간, 행/초, MB/초, 최대 메모리)
+metrics_jsonl_file = "C:/문서/UDS/move_table_metrics.jsonl"  # 테이블마다 한 줄씩 추가 (None이면 저장 안 함)
+metrics_prom_file = None  # 예: "/var/lib/node_exporter/textfile/move_table.prom" (Prometheus textfile collector)
+
+# 카탈로그 캐시 설정 (테이블 목록 전체의 컬럼/PK/인덱스 정보를 한 번에 조회하여 재사용)
+catalog_cache_file = None  # 예: "C:/문서/UDS/schema_catalog.json" (지정하면 다음 실행에서 재사용)
+refresh_catalog = False  # True면 캐시 파일이 있어도 Source DB에서 다시 조회
+
+# Source 테이블 스키마 모델 ({"schema.table": entry}), 실행 시 한 번에 조회
+catalog = {}
+
+# Source/Target DB 연결 풀
+source_pool = ThreadedConnectionPool(1, max_workers, host=source_host, dbname=source_dbname, user=source_user, password=source_password)
+target_pool = ThreadedConnectionPool(1, max_workers, host=target_host, dbname=target_dbname, user=target_user, password=target_password)
+
+# 스레드 안전한 출력을 위한 락
+print_lock = threading.Lock()
+
+def safe_print(*args, **kwargs):
+    with print_lock:
+        print(*args, **kwargs)
+
+# ---------------------------
+# 체크포인트 저장소
+# ---------------------------
+# {"schema.table": {"status": "done" | "partial", "ranges": [...], "range_method": "pk" | "ctid", "ranges_done": [...],
+#                   "high_water_mark": ..., "server_started": UNLOGGED 테이블 생성 시점의 Target 서버 시작 시각}}
+checkpoint_lock = threading.Lock()
+checkpoint_state = {}
+
+def load_checkpoint():
+    if resume and os.path.exists(checkpoint_file):
+        with open(checkpoint_file, 'r', encoding='utf-8') as f:
+            checkpoint_state.update(json.load(f))
+        print(f"Loaded checkpoint from {checkpoint_file} ({len(checkpoint_state)} tables)")
+
+# 임시 파일에 쓴 뒤 교체하여 저장 도중 중단되어도 파일이 깨지지 않게 함
+def save_checkpoint():
+    temp_file = f"{checkpoint_file}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint_state, f, ensure_ascii=False, indent=2)
+    os.replace(temp_file, checkpoint_file)
+
+def get_checkpoint(table_key):
+    with checkpoint_lock:
+        return dict(checkpoint_state.get(table_key, {}))
+
+def update_checkpoint(table_key, **fields):
+    with checkpoint_lock:
+        checkpoint_state.setdefault(table_key, {}).update(fields)
+        save_checkpoint()
+
+# 범위 하나의 완료를 기록 (여러 범위 워커가 동시에 호출)
+def mark_range_done(table_key, where):
+    with checkpoint_lock:
+        entry = checkpoint_state.setdefault(table_key, {})
+        entry.setdefault('ranges_done', []).append(where)
+        save_checkpoint()
+
+# 범위 분할 복사용 개별 연결
+def connect_source():
+    return psycopg2.connect(host=source_host, dbname=source_dbname, user=source_user, password=source_password)
+
+def connect_target():
+    return psycopg2.connect(host=target_host, dbname=target_dbname, user=target_user, password=target_password)
+
+# Target 서버 시작 시각 (UNLOGGED 테이블을 만든 뒤 서버가 재시작되었는지 확인용)
+def target_server_started(target_cur):
+    target_cur.execute("SELECT pg_postmaster_start_time()::text;")
+    return target_cur.fetchone()[0]
+
+# 이어서 복사할 Target 테이블의 기존 데이터를 믿을 수 있는지 확인
+# UNLOGGED 테이블은 서버가 비정상 종료 후 복구되면 비워지므로, 테이블을 만든 뒤 서버가 재시작되었으면
+# (정상 재시작도 구분할 수 없으므로 함께) 체크포인트를 무시하고 처음부터 다시 복사
+def target_data_intact(target_cur, relation, checkpoint):
+    target_cur.execute("SELECT relpersistence FROM pg_class WHERE oid = to_regclass(%s);", (relation,))
+    row = target_cur.fetchone()
+    if row is None:
+        return False
+    if row[0] != 'u':
+        return True
+    return checkpoint.get('server_started') == target_server_started(target_cur)
+
+# binary COPY 사용 가능 여부 확인
+# binary 포맷은 타입별 내부 표현을 그대로 주고받으므로 양쪽 서버 메이저 버전이 같을 때만 사용
+def use_binary_copy(source_conn, target_conn):
+    if copy_format != 'binary':
+        return False
+    return source_conn.server_version // 10000 == target_conn.server_version // 10000
+
+# Source의 COPY 출력을 파이프로 Target의 COPY 입력에 바로 흘려보내는 함수
+# 파이프 버퍼 크기만큼만 메모리에 머무르므로 테이블 크기와 관계없이 메모리 사용량이 일정함
+# where를 주면 해당 범위만, target_table을 주면 Target의 다른 테이블(스테이징 테이블)로 복사
+def stream_copy(source_conn, target_conn, schema_name, table_name, columns, where=None, target_table=None):
+    source_cur = source_conn.cursor()
+    target_cur = target_conn.cursor()
+    columns_str = ", ".join(columns)
+    copy_options = "(FORMAT binary)" if use_binary_copy(source_conn, target_conn) else "(FORMAT text)"
+    where_clause = f" WHERE {where}" if where else ""
+    copy_out_query = f"COPY (SELECT {columns_str} FROM {schema_name}.{table_name}{where_clause}) TO STDOUT WITH {copy_options}"
+    copy_in_query = f"COPY {schema_name}.{target_table or table_name} ({columns_str}) FROM STDIN WITH {copy_options}"
+    safe_print(f"Streaming data with: {copy_out_query}")
+
+    read_fd, write_fd = os.pipe()
+    reader = instrumentation.CountingReader(os.fdopen(read_fd, 'rb'))
+    writer = os.fdopen(write_fd, 'wb')
+    load_errors = []
+
+    # Target 쪽 COPY FROM STDIN은 별도 스레드에서 파이프를 읽음
+    def load():
+        try:
+            target_cur.copy_expert(copy_in_query, reader, size=copy_buffer_size)
+        except Exception as e:
+            load_errors.append(e)
+        finally:
+            # 읽기 쪽을 닫아야 적재 실패 시 쓰기 쪽이 BrokenPipeError로 즉시 깨어남
+            reader.close()
+
+    loader = threading.Thread(target=load, name=f"copy-{schema_name}.{table_name}")
+    loader.start()
+
+    dump_error = None
+    try:
+        source_cur.copy_expert(copy_out_query, writer)
+    except Exception as e:
+        dump_error = e
+    finally:
+        try:
+            writer.close()  # EOF 전달
+        except OSError as e:
+            dump_error = dump_error or e
+        loader.join()
+    instrumentation.add_bytes(f"{schema_name}.{table_name}", reader.bytes_read)
+
+    # 적재 쪽 오류가 원인인 경우가 많으므로 먼저 확인
+    if load_errors:
+        raise load_errors[0]
+    if dump_error:
+        raise dump_error
+    return target_cur.rowcount
+
+# 서버 사이드 커서로 일정 행 수씩 읽어 변환 후 다중 행 INSERT로 쓰는 함수
+# 한 번에 cursor_itersize 행만 메모리에 올리므로 테이블 크기와 관계없이 RSS가 일정하게 유지됨
+# pk_column이 있으면 PK 순서로 읽고 청크마다 커밋하며 마지막 PK를 체크포인트에 기록
+# start_after가 있으면 해당 PK 다음부터 이어서 복사
+def cursor_copy(source_conn, target_conn, schema_name, table_name, columns, transform=None, pk_column=None, start_after=None):
+    table_key = f"{schema_name}.{table_name}"
+    target_cur = target_conn.cursor()
+    columns_str = ", ".join(columns)
+    insert_query = f"INSERT INTO {schema_name}.{table_name} ({columns_str}) VALUES %s"
+    safe_print(f"Reading with server-side cursor (itersize={cursor_itersize}): {insert_query}")
+
+    itersize = cursor_itersize
+    copied_rows = 0
+    peak_rss = instrumentation.sample_rss(table_key) or 0
+    source_named_cur = source_conn.cursor(name=f"move_{schema_name}_{table_name}")
+    try:
+        if pk_column is None:
+            source_named_cur.execute(f"SELECT {columns_str} FROM {schema_name}.{table_name};")
+        elif start_after is None:
+            source_named_cur.execute(f"SELECT {columns_str} FROM {schema_name}.{table_name} ORDER BY {pk_column};")
+        else:
+            safe_print(f"Resuming {table_key} after {pk_column} = {start_after}")
+            source_named_cur.execute(
+                f"SELECT {columns_str} FROM {schema_name}.{table_name} WHERE {pk_column} > %s ORDER BY {pk_column};",
+                (start_after,))
+        pk_index = columns.index(pk_column) if pk_column else None
+        while True:
+            rows = source_named_cur.fetchmany(itersize)
+            if not rows:
+                break
+            last_key = rows[-1][pk_index] if pk_column else None
+            if transform is not None:
+                rows = [transform(row) for row in rows]
+            execute_values(target_cur, insert_query, rows, page_size=write_page_size)
+            copied_rows += len(rows)
+            del rows
+            if pk_column:
+                target_conn.commit()
+                update_checkpoint(table_key, status='partial', high_water_mark=last_key)
+
+            rss = instrumentation.sample_rss(table_key)
+            if rss is not None:
+                peak_rss = max(peak_rss, rss)
+            # 메모리 상한을 넘으면 한 번에 가져오는 행 수를 줄임 (현재 RSS를 알 수 있을 때만)
+            rss = instrumentation.current_rss_mb()
+            if memory_limit_mb and rss is not None and rss > memory_limit_mb and itersize > min_itersize:
+                itersize = max(itersize // 2, min_itersize)
+                safe_print(f"RSS {rss:.0f} MB exceeds limit {memory_limit_mb} MB, itersize reduced to {itersize}")
+            safe_print(f"Copied {copied_rows} rows")
+    finally:
+        source_named_cur.close()
+    return copied_rows, peak_rss
+
+# 스냅샷 안에서 테이블을 겹치지 않는 범위(WHERE 조건)로 나눔 (실제 사용한 분할 방식과 범위 목록 반환)
+# 마지막 범위는 상한 없이 열어 두어 어떤 행도 빠지지 않게 함
+def build_copy_ranges(snapshot_cur, schema_name, table_name, count):
+    pk_column = integer_pk(catalog[f"{schema_name}.{table_name}"]) if partition_method == 'pk' else None
+    if pk_column:
+        snapshot_cur.execute(f"SELECT MIN({pk_column}), MAX({pk_column}) FROM {schema_name}.{table_name};")
+        low, high = snapshot_cur.fetchone()
+        if low is None:
+            return 'pk', [None]
+        step = max(math.ceil((high - low + 1) / count), 1)
+        bounds = list(range(low, high + 1, step))
+        ranges = [f"{pk_column} >= {start} AND {pk_column} < {start + step}" for start in bounds[:-1]]
+        ranges.append(f"{pk_column} >= {bounds[-1]}")
+        return 'pk', ranges
+
+    # ctid 페이지 범위
+    snapshot_cur.execute(
+        "SELECT pg_relation_size(format('%%I.%%I', %s, %s)::regclass) / current_setting('block_size')::bigint;",
+        (schema_name, table_name))
+    pages = snapshot_cur.fetchone()[0]
+    step = max(math.ceil(pages / count), 1)
+    bounds = list(range(0, max(pages, 1), step))
+    ranges = [f"ctid >= '({start},0)'::tid AND ctid < '({start + step},0)'::tid" for start in bounds[:-1]]
+    ranges.append(f"ctid >= '({bounds[-1]},0)'::tid")
+    return 'ctid', ranges
+
+# PK 범위별 행 수와 해시를 서버에서 계산 ({범위 번호: (행 수, 해시)})
+# 타임존/날짜/실수 출력 형식에 따라 행의 텍스트 표현이 달라지지 않도록 세션 설정을 고정
+def fetch_range_hashes(conn, schema_name, table_name, columns, pk_column, low):
+    columns_str = ", ".join(columns)
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL TimeZone TO 'UTC'; SET LOCAL DateStyle TO 'ISO, YMD'; SET LOCAL extra_float_digits TO 3;")
+        cur.execute(f"""
+            SELECT ({pk_column} - %s) / %s AS bucket,
+                   count(*),
+                   md5(string_agg(md5(ROW({columns_str})::text), '' ORDER BY {pk_column}))
+            FROM {schema_name}.{table_name}
+            GROUP BY 1;
+        """, (low, sync_chunk_size))
+        hashes = {bucket: (row_count, range_hash) for bucket, row_count, range_hash in cur.fetchall()}
+    conn.commit()
+    return hashes
+
+# 해시가 다른 PK 범위만 Target에서 지우고 Source에서 다시 복사 (범위 단위 upsert)
+# 동기화할 수 없는 테이블이면 None을 반환하여 전체 복사로 넘어감
+# 이전 실행이 적재 후 인덱스 생성/ANALYZE/SET LOGGED 단계에서 실패했으면 해시가 같아도 테이블이 완성되지 않았으므로
+# (UNLOGGED로 남아 있거나 카탈로그보다 인덱스가 적음) 전체 복사로 다시 만듦
+def delta_sync(source_conn, target_conn, schema_name, table_name, columns):
+    source_cur = source_conn.cursor()
+    target_cur = target_conn.cursor()
+    table_key = f"{schema_name}.{table_name}"
+    pk_column = integer_pk(catalog[table_key])
+    if pk_column is None or pk_column not in columns:
+        return None
+    target_cur.execute("""
+        SELECT c.relpersistence, (SELECT count(*) FROM pg_index i WHERE i.indrelid = c.oid)
+        FROM pg_class c
+        WHERE c.oid = to_regclass(%s);
+    """, (table_key,))
+    row = target_cur.fetchone()
+    target_conn.commit()
+    if row is None:
+        return None
+    relpersistence, index_count = row
+    if relpersistence == 'u':
+        safe_print(f"{table_key} is still UNLOGGED in target (previous load was not finalized)")
+        return None
+    if build_indexes and index_count < len(catalog[table_key]['indexes']):
+        safe_print(f"{table_key} has {index_count} of {len(catalog[table_key]['indexes'])} indexes in target (previous load was not finalized)")
+        return None
+
+    # 양쪽 최소 PK 중 작은 값을 기준으로 같은 범위 경계를 사용
+    source_cur.execute(f"SELECT MIN({pk_column}) FROM {schema_name}.{table_name};")
+    target_cur.execute(f"SELECT MIN({pk_column}) FROM {schema_name}.{table_name};")
+    mins = [value for value in (source_cur.fetchone()[0], target_cur.fetchone()[0]) if value is not None]
+    source_conn.commit()
+    target_conn.commit()
+    if not mins:
+        return 0, 0
+    low = min(mins)
+
+    # 양쪽 해시 계산을 동시에 실행
+    with instrumentation.phase(table_key, 'verify'), ThreadPoolExecutor(max_workers=2) as executor:
+        source_future = executor.submit(fetch_range_hashes, source_conn, schema_name, table_name, columns, pk_column, low)
+        target_future = executor.submit(fetch_range_hashes, target_conn, schema_name, table_name, columns, pk_column, low)
+        source_hashes = source_future.result()
+        target_hashes = target_future.result()
+
+    changed = sorted(bucket for bucket in source_hashes.keys() | target_hashes.keys()
+                     if source_hashes.get(bucket) != target_hashes.get(bucket))
+    safe_print(f"{schema_name}.{table_name}: {len(changed)} of {len(source_hashes)} ranges changed")
+
+    copied_rows = 0
+    with instrumentation.phase(table_key, 'data'):
+        for bucket in changed:
+            start = low + bucket * sync_chunk_size
+            where = f"{pk_column} >= {start} AND {pk_column} < {start + sync_chunk_size}"
+            target_cur.execute(f"DELETE FROM {schema_name}.{table_name} WHERE {where};")
+            copied_rows += stream_copy(source_conn, target_conn, schema_name, table_name, columns, where=where)
+            target_conn.commit()
+            source_conn.commit()
+    return len(changed), copied_rows
+
+# 내보낸 스냅샷으로 범위 하나를 스테이징 테이블에 복사 (범위 워커)
+# PK 범위는 COPY와 같은 트랜잭션에서 해당 범위를 먼저 지워, 커밋 후 완료 기록 전에 중단되어 다시 복사해도 중복되지 않게 함
+# (ctid 범위는 스테이징 테이블의 행 위치가 Source와 다르므로 지우지 않음, 재실행 시 처음부터 다시 복사)
+def copy_range(snapshot_id, schema_name, table_name, staging_table, columns, where, clear_range=False):
+    source_conn = connect_source()
+    target_conn = connect_target()
+    try:
+        source_conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        source_conn.cursor().execute("SET TRANSACTION SNAPSHOT %s;", (snapshot_id,))
+        if clear_range:
+            target_conn.cursor().execute(f"DELETE FROM {schema_name}.{staging_table} WHERE {where};")
+        copied_rows = stream_copy(source_conn, target_conn, schema_name, table_name, columns,
+                                  where=where, target_table=staging_table)
+        target_conn.commit()
+        mark_range_done(f"{schema_name}.{table_name}", where)
+        return copied_rows
+    finally:
+        source_conn.rollback()
+        source_conn.close()
+        target_conn.close()
+
+# 큰 테이블을 여러 범위로 나눠 동시에 복사한 뒤 Target에서 한 번에 교체하는 함수
+# 모든 범위 워커가 pg_export_snapshot으로 내보낸 같은 스냅샷을 사용하므로 복사 중 변경이 섞이지 않음
+# 체크포인트에 PK 범위 목록이 있으면 스테이징 테이블을 유지하고 완료되지 않은 범위만 복사
+# ctid 범위는 재실행 시 새 스냅샷에서 UPDATE/VACUUM FULL/CLUSTER로 행 위치가 바뀌었을 수 있어
+# 이미 복사한 범위로 옮겨간 행은 빠지고 다른 범위로 옮겨간 행은 중복되므로 처음부터 다시 복사
+def partitioned_copy(target_conn, schema_name, table_name, columns, column_defs):
+    table_key = f"{schema_name}.{table_name}"
+    staging_table = f"{table_name}__load"
+    target_cur = target_conn.cursor()
+    checkpoint = get_checkpoint(table_key)
+    target_cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (f"{schema_name}.{staging_table}",))
+    staging_exists = target_cur.fetchone()[0]
+    resuming = (bool(checkpoint.get('ranges')) and staging_exists and checkpoint.get('range_method') == 'pk'
+                and target_data_intact(target_cur, f"{schema_name}.{staging_table}", checkpoint))
+    if staging_exists and not resuming:
+        safe_print(f"Discarding staging table {schema_name}.{staging_table} (ranges cannot be resumed)")
+    if not resuming:
+        target_cur.execute(f"DROP TABLE IF EXISTS {schema_name}.{staging_table};")
+        target_cur.execute(f"CREATE {'UNLOGGED ' if unlogged_load else ''}TABLE {schema_name}.{staging_table} ({column_defs});")
+        update_checkpoint(table_key, status='partial', ranges=[], ranges_done=[],
+                          server_started=target_server_started(target_cur))
+    target_conn.commit()
+
+    # 스냅샷을 내보낸 연결은 모든 범위 복사가 끝날 때까지 트랜잭션을 유지해야 함
+    snapshot_conn = connect_source()
+    try:
+        snapshot_conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        snapshot_cur = snapshot_conn.cursor()
+        snapshot_cur.execute("SELECT pg_export_snapshot();")
+        snapshot_id = snapshot_cur.fetchone()[0]
+        if resuming:
+            # 재실행 시에는 처음 나눈 범위를 그대로 사용해야 이미 복사한 범위와 겹치지 않음
+            ranges = [where for where in checkpoint['ranges'] if where not in checkpoint.get('ranges_done', [])]
+            range_method = checkpoint['range_method']
+            safe_print(f"Resuming {table_key}: {len(ranges)} of {len(checkpoint['ranges'])} ranges left")
+        else:
+            range_method, ranges = build_copy_ranges(snapshot_cur, schema_name, table_name, partition_count)
+            update_checkpoint(table_key, ranges=ranges, range_method=range_method)
+        safe_print(f"Copying {schema_name}.{table_name} in {len(ranges)} ranges from snapshot {snapshot_id}")
+
+        copied_rows = 0
+        with ThreadPoolExecutor(max_workers=partition_count) as executor:
+            futures = [
+                executor.submit(copy_range, snapshot_id, schema_name, table_name, staging_table, columns, where,
+                                range_method == 'pk')
+                for where in ranges
+            ]
+            for future in as_completed(futures):
+                copied_rows += future.result()
+    finally:
+        snapshot_conn.rollback()
+        snapshot_conn.close()
+
+    # 기존 테이블 삭제와 스테이징 테이블 이름 변경을 한 트랜잭션으로 처리하여 원자적으로 교체
+    target_cur.execute(f"DROP TABLE IF EXISTS {schema_name}.{table_name} CASCADE;")
+    target_cur.execute(f"ALTER TABLE {schema_name}.{staging_table} RENAME TO {table_name};")
+    target_conn.commit()
+    return copied_rows
+
+# pg_get_indexdef 결과의 인덱스 이름 부분 ("CREATE [UNIQUE] INDEX <이름> ON ...")
+INDEX_NAME_PATTERN = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )("(?:[^"]|"")+"|\S+)( ON )')
+
+# Target에서 사용할 인덱스/제약조건 이름
+# change_dbname.py로 이름만 바꾼 백업 테이블(X_back0115)은 원래 인덱스 이름(X_pkey 등)을 그대로 갖고 있으므로
+# 같은 스키마에 이미 있는 이름이면 뒤에 번호를 붙여 겹치지 않는 이름을 사용
+def target_index_name(target_cur, schema_name, name, reserved):
+    candidate = name
+    suffix = 0
+    while True:
+        if candidate not in reserved:
+            target_cur.execute("SELECT to_regclass(format('%%I.%%I', %s, %s)) IS NULL;", (schema_name, candidate))
+            if target_cur.fetchone()[0]:
+                reserved.add(candidate)
+                if candidate != name:
+                    safe_print(f"{schema_name}.{name} already exists in target, using {candidate}")
+                return candidate
+        suffix += 1
+        candidate = f"{name[:62 - len(str(suffix))]}_{suffix}"
+
+# 인덱스 DDL의 이름을 Target용 이름으로 교체
+def rename_index_ddl(target_cur, index_ddl, name):
+    renamed, count = INDEX_NAME_PATTERN.subn(lambda m: m.group(1) + quote_ident(name, target_cur) + m.group(3), index_ddl, count=1)
+    if count != 1:
+        raise ValueError(f"Unexpected index definition: {index_ddl}")
+    return renamed
+
+# 인덱스 하나를 별도 연결에서 생성 (CREATE INDEX끼리는 같은 테이블이어도 동시에 실행 가능)
+def create_index(index_ddl):
+    conn = connect_target()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SET maintenance_work_mem TO %s;", (index_maintenance_work_mem,))
+            cur.execute(index_ddl)
+        conn.commit()
+    finally:
+        conn.close()
+
+# 적재가 끝난 테이블에 인덱스/제약조건을 만들고 ANALYZE 후 LOGGED로 전환
+def finalize_table(target_conn, schema_name, table_name):
+    table_key = f"{schema_name}.{table_name}"
+    with instrumentation.phase(table_key, 'index'):
+        build_table_indexes(target_conn, schema_name, table_name)
+
+def build_table_indexes(target_conn, schema_name, table_name):
+    target_cur = target_conn.cursor()
+    target_conn.commit()
+
+    table_key = f"{schema_name}.{table_name}"
+    if build_indexes and table_key not in column_subsets:
+        indexes = catalog[table_key]['indexes']
+        # 제약조건에 연결할 인덱스는 제약조건 이름으로 만들어 USING INDEX 시 이름이 바뀌지 않게 함
+        # (인덱스/제약조건 이름이 Target 스키마에 이미 있으면 겹치지 않는 이름으로 바꿈)
+        reserved = set()
+        target_names = {
+            index['name']: target_index_name(target_cur, schema_name, index['constraint_name'] or index['name'], reserved)
+            for index in indexes
+        }
+        # EXCLUDE 제약조건은 USING INDEX로 붙일 수 없으므로 제약조건으로 직접 생성
+        index_ddls = [rename_index_ddl(target_cur, index['definition'], target_names[index['name']])
+                      for index in indexes if index['constraint_type'] != 'x']
+        target_conn.commit()
+        if index_ddls:
+            safe_print(f"Building {len(index_ddls)} indexes on {table_key}")
+            with ThreadPoolExecutor(max_workers=index_workers) as executor:
+                for future in as_completed([executor.submit(create_index, ddl) for ddl in index_ddls]):
+                    future.result()
+
+        # PK/UNIQUE는 미리 만든 유니크 인덱스를 그대로 사용하여 제약조건만 연결
+        for index in indexes:
+            name = quote_ident(target_names[index['name']], target_cur)
+            contype = index['constraint_type']
+            constraint_def = index['constraint_definition']
+            if contype == 'p':
+                target_cur.execute(f"ALTER TABLE {schema_name}.{table_name} ADD CONSTRAINT {name} PRIMARY KEY USING INDEX {name};")
+            elif contype == 'u':
+                target_cur.execute(f"ALTER TABLE {schema_name}.{table_name} ADD CONSTRAINT {name} UNIQUE USING INDEX {name};")
+            elif contype == 'x':
+                target_cur.execute(f"ALTER TABLE {schema_name}.{table_name} ADD CONSTRAINT {name} {constraint_def};")
+
+    target_cur.execute(f"ANALYZE {schema_name}.{table_name};")
+    if unlogged_load:
+        target_cur.execute(f"ALTER TABLE {schema_name}.{table_name} SET LOGGED;")
+    target_conn.commit()
 
 # 테이블을 복사하는 함수
-def copy_table(schema_name, table_name):
+def copy_table(schema_name, table_name, source_conn, target_conn):
+    source_cur = source_conn.cursor()
+    target_cur = target_conn.cursor()
     try:
-        print(f"\nStarting to copy {schema_name}.{table_name}")
-        
-        # Source DB에서 테이블 구조 조회 시 geometry 타입의 SRID도 함께 조회
-        source_cur.execute(f"""
-            SELECT 
-                c.column_name,
-                CASE 
-                    WHEN c.udt_name = 'geometry' THEN 
-                        CONCAT('geometry(', g.type, ', ', g.srid, ')')
-                    WHEN c.udt_name = 'geography' THEN 
-                        CONCAT('geography(', g.type, ', ', g.srid, ')')
-                    ELSE c.data_type
-                END as data_type,
-                c.character_maximum_length,
-                c.numeric_precision,
-                c.numeric_scale
-            FROM information_schema.columns c
-            LEFT JOIN (
-                SELECT 
-                    f_table_schema,
-                    f_table_name,
-                    f_geometry_column,
-                    type,
-                    srid
-                FROM geometry_columns
-            ) g ON 
-                c.table_schema = g.f_table_schema AND
-                c.table_name = g.f_table_name AND
-                c.column_name = g.f_geometry_column
-            WHERE c.table_schema = %s AND c.table_name = %s
-            ORDER BY c.ordinal_position;
-        """, (schema_name, table_name))
+        safe_print(f"\nStarting to copy {schema_name}.{table_name}")
         
-        columns_info = source_cur.fetchall()
-        print(f"Found {len(columns_info)} columns in source table")
+        # 미리 조회한 카탈로그에서 테이블 구조 확인 (geometry 타입은 typmod에 도형 타입과 SRID 포함)
+        table_key = f"{schema_name}.{table_name}"
+        entry = catalog.get(table_key)
+        if not entry or not entry['exists']:
+            raise ValueError(f"Table {table_key} does not exist in source database")
+        columns = column_names(entry)
+        safe_print(f"Found {len(columns)} columns in source table")
+
+        # 컬럼 일부만 복사하는 경우 해당 컬럼만 남김
+        if table_key in column_subsets:
+            columns = [column for column in columns if column in column_subsets[table_key]]
+        column_defs = column_definitions(entry, columns)
 
         # Target DB에 스키마 생성
-        target_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
-        
-        # 테이블 생성 쿼리 구성
-        create_table_query = f"CREATE TABLE {schema_name}.{table_name} ("
-        columns = []
-        for col_name, data_type, char_max_length, num_precision, num_scale in columns_info:
-            col_def = f"{col_name} {data_type}"
-            if data_type == 'character varying' and char_max_length:
-                col_def += f"({char_max_length})"
-            elif data_type == 'numeric' and num_precision:
-                if num_scale:
-                    col_def += f"({num_precision},{num_scale})"
-                else:
-                    col_def += f"({num_precision})"
-            columns.append(col_def)
-        
-        create_table_query += ", ".join(columns) + ");"
-        print(f"Creating table with query: {create_table_query}")
-        
-        # 기존 테이블이 있으면 삭제
-        target_cur.execute(f"DROP TABLE IF EXISTS {schema_name}.{table_name} CASCADE;")
-        target_cur.execute(create_table_query)
-
-        # Source DB에서 데이터 조회
-        source_cur.execute(f"SELECT * FROM {schema_name}.{table_name};")
-        rows = source_cur.fetchall()
-        print(f"Found {len(rows)} rows in source table")
-        
-        if rows:
-            # 데이터 삽입
-            columns = [col[0] for col in columns_info]
-            columns_str = ", ".join(columns)
-            placeholders = ", ".join(["%s"] * len(columns))
-            
-            insert_query = f"INSERT INTO {schema_name}.{table_name} ({columns_str}) VALUES ({placeholders})"
-            print(f"Inserting data with query template: {insert_query}")
-            
-            # 배치 처리로 변경 (한 번에 1000행씩)
-            batch_size = 1000
-            for i in range(0, len(rows), batch_size):
-                batch = rows[i:i + batch_size]
-                target_cur.executemany(insert_query, batch)
-                target_conn.commit()  # 각 배치마다 커밋
-                print(f"Inserted batch {i//batch_size + 1} ({len(batch)} rows)")
+        with instrumentation.phase(table_key, 'ddl'):
+            target_cur.execute(f"CREATE SCHEMA IF NOT EXISTS {schema_name};")
+
+        checkpoint = get_checkpoint(table_key)
+
+        # delta 모드는 기존 테이블을 유지한 채 바뀐 범위만 다시 복사
+        is_plain_copy = copy_mode == 'stream' and table_key not in row_transforms and table_key not in column_subsets
+        if is_plain_copy and sync_mode == 'delta':
+            target_conn.commit()
+            source_conn.commit()
+            synced = delta_sync(source_conn, target_conn, schema_name, table_name, columns)
+            if synced is not None:
+                changed_ranges, copied_rows = synced
+                instrumentation.add_rows(table_key, copied_rows)
+                safe_print(f"Synced {changed_ranges} changed ranges ({copied_rows} rows)")
+                return
+            safe_print(f"{table_key} cannot be delta-synced, falling back to full copy")
+
+        # 큰 테이블은 범위로 나눠 병렬 복사 (기존 테이블은 복사가 끝난 뒤 교체)
+        if is_plain_copy and partition_threshold_mb and entry['size_bytes'] >= partition_threshold_mb * 1024 * 1024:
+            target_conn.commit()
+            source_conn.commit()
+            with instrumentation.phase(table_key, 'data'):
+                copied_rows = partitioned_copy(target_conn, schema_name, table_name, columns, column_defs)
+            instrumentation.add_rows(table_key, copied_rows)
+            finalize_table(target_conn, schema_name, table_name)
+            safe_print(f"Copied {copied_rows} rows via {partition_method} range partitions")
+            return
+
+        # 서버 사이드 커서 경로는 정수형 단일 PK가 있으면 마지막 PK 위치부터 이어서 복사 가능
+        use_cursor = table_key in row_transforms or table_key in column_subsets
+        pk_column = integer_pk(entry) if use_cursor else None
+        if pk_column not in columns:
+            pk_column = None
+        start_after = checkpoint.get('high_water_mark') if pk_column else None
+        if start_after is not None and not target_data_intact(target_cur, table_key, checkpoint):
+            safe_print(f"{table_key} target data cannot be trusted (missing or UNLOGGED after a server restart), copying from the start")
+            start_after = None
+
+        if start_after is None:
+            create_table_query = f"CREATE {'UNLOGGED ' if unlogged_load else ''}TABLE {schema_name}.{table_name} ({column_defs});"
+            safe_print(f"Creating table with query: {create_table_query}")
+
+            # 기존 테이블이 있으면 삭제
+            with instrumentation.phase(table_key, 'ddl'):
+                target_cur.execute(f"DROP TABLE IF EXISTS {schema_name}.{table_name} CASCADE;")
+                target_cur.execute(create_table_query)
+            if pk_column:
+                update_checkpoint(table_key, status='partial', high_water_mark=None,
+                                  server_started=target_server_started(target_cur))
+
+        if use_cursor:
+            # 행 단위 변환이 필요한 경우 서버 사이드 커서 경로 사용
+            with instrumentation.phase(table_key, 'data'):
+                copied_rows, peak_rss = cursor_copy(source_conn, target_conn, schema_name, table_name, columns,
+                                                    row_transforms.get(table_key), pk_column, start_after)
+                target_conn.commit()
+                source_conn.commit()
+            instrumentation.add_rows(table_key, copied_rows)
+            finalize_table(target_conn, schema_name, table_name)
+            safe_print(f"Copied {copied_rows} rows via server-side cursor (peak RSS {peak_rss:.0f} MB)")
+            return
+
+        if copy_mode == 'stream':
+            # 테이블 생성과 COPY를 한 트랜잭션에서 처리 (wal_level=minimal이면 WAL 기록도 생략됨)
+            with instrumentation.phase(table_key, 'data'):
+                copied_rows = stream_copy(source_conn, target_conn, schema_name, table_name, columns)
+                target_conn.commit()
+                source_conn.commit()
+            instrumentation.add_rows(table_key, copied_rows)
+            finalize_table(target_conn, schema_name, table_name)
+            safe_print(f"Copied {copied_rows} rows via COPY")
+            return
+
+        with instrumentation.phase(table_key, 'data'):
+            # Source DB에서 데이터 조회
+            source_cur.execute(f"SELECT * FROM {schema_name}.{table_name};")
+            rows = source_cur.fetchall()
+            safe_print(f"Found {len(rows)} rows in source table")
+
+            if rows:
+                # 데이터 삽입
+                columns_str = ", ".join(columns)
+                placeholders = ", ".join(["%s"] * len(columns))
+
+                insert_query = f"INSERT INTO {schema_name}.{table_name} ({columns_str}) VALUES ({placeholders})"
+                safe_print(f"Inserting data with query template: {insert_query}")
+
+                # 배치 처리로 변경 (한 번에 1000행씩)
+                batch_size = 1000
+                for i in range(0, len(rows), batch_size):
+                    batch = rows[i:i + batch_size]
+                    target_cur.executemany(insert_query, batch)
+                    target_conn.commit()  # 각 배치마다 커밋
+                    safe_print(f"Inserted batch {i//batch_size + 1} ({len(batch)} rows)")
+        instrumentation.add_rows(table_key, len(rows))
+
+        finalize_table(target_conn, schema_name, table_name)
 
     except Exception as e:
-        print(f"Detailed error copying {schema_name}.{table_name}:")
-        print(f"Error type: {type(e).__name__}")
-        print(f"Error message: {str(e)}")
+        safe_print(f"Detailed error copying {schema_name}.{table_name}:")
+        safe_print(f"Error type: {type(e).__name__}")
+        safe_print(f"Error message: {str(e)}")
         import traceback
-        print("Traceback:")
-        print(traceback.format_exc())
+        safe_print("Traceback:")
+        safe_print(traceback.format_exc())
         target_conn.rollback()
         source_conn.rollback()
-        raise  # 에러를 다시 발생시켜서 전체 프로세스 중단
+        raise  # 에러를 다시 발생시켜서 호출한 워커에서 실패로 처리
+
+# 풀에서 연결을 받아 테이블 하나를 복사하는 워커
+def copy_table_worker(schema_name, table_name):
+    source_conn = source_pool.getconn()
+    target_conn = target_pool.getconn()
+    try:
+        copy_table(schema_name, table_name, source_conn, target_conn)
+        update_checkpoint(f"{schema_name}.{table_name}", status='done')
+        instrumentation.finish_table(f"{schema_name}.{table_name}", 'done')
+    except Exception:
+        instrumentation.finish_table(f"{schema_name}.{table_name}", 'failed')
+        raise
+    finally:
+        source_pool.putconn(source_conn)
+        target_pool.putconn(target_conn)
+
+# Source DB에서 테이블 목록 전체의 카탈로그 정보를 한 번에 조회
+def load_catalog(tables):
+    conn = source_pool.getconn()
+    try:
+        return load_schema_catalog(conn, tables, catalog_cache_file, refresh_catalog)
+    finally:
+        source_pool.putconn(conn)
+
+instrumentation.start_run('move_table', metrics_jsonl_file, metrics_prom_file)
+if memory_limit_mb and instrumentation.current_rss_mb() is None:
+    print(f"Warning: psutil is not installed, memory_limit_mb ({memory_limit_mb} MB) is not enforced")
+load_checkpoint()
 
 # CSV 파일에서 스키마와 테이블 이름 읽기
+tables = []
 for index, row in df.iterrows():
     schema_name = row.iloc[0]  # 첫 번째 열: 스키마 이름
     table_name = row.iloc[1]   # 두 번째 열: 테이블 이름
-    print(schema_name, table_name)
-    # 테이블 복사
-    copy_table(schema_name, table_name)
+    # 이전 실행에서 완료된 테이블은 건너뜀
+    if get_checkpoint(f"{schema_name}.{table_name}").get('status') == 'done':
+        print(f"Skipping {schema_name}.{table_name} (completed in previous run)")
+        continue
+    tables.append((schema_name, table_name))
+
+# 큰 테이블부터 워커에 배분 (가장 긴 작업이 마지막에 남지 않도록)
+with instrumentation.phase(None, 'introspect'):
+    catalog.update(load_catalog(tables))
+tables.sort(key=lambda t: catalog.get(f"{t[0]}.{t[1]}", {}).get('size_bytes', 0), reverse=True)
+
+# 테이블 복사 (워커별로 독립 처리, 실패한 테이블은 기록 후 계속 진행)
+failed_tables = []
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    future_to_table = {
+        executor.submit(copy_table_worker, schema_name, table_name): (schema_name, table_name)
+        for schema_name, table_name in tables
+    }
+    for future in as_completed(future_to_table):
+        schema_name, table_name = future_to_table[future]
+        try:
+            future.result()
+            safe_print(f"Finished {schema_name}.{table_name} ({catalog.get(f'{schema_name}.{table_name}', {}).get('size_bytes', 0) / (1024 * 1024):.1f} MB)")
+        except Exception:
+            failed_tables.append((schema_name, table_name))
+
+# 실패한 테이블은 table_list.csv와 같은 형식으로 저장하여 재실행에 사용
+if failed_tables:
+    pd.DataFrame(failed_tables, columns=df.columns[:2]).to_csv(failed_csv_file, index=False)
+    print(f"\nFailed tables ({len(failed_tables)}): {', '.join(f'{s}.{t}' for s, t in failed_tables)}")
+    print(f"Failed table list saved to {failed_csv_file}")
+    print(f"Rerun to resume from checkpoint {checkpoint_file}")
+elif os.path.exists(checkpoint_file):
+    # 모든 테이블이 완료되면 다음 이관은 처음부터 시작하도록 체크포인트 삭제
+    os.remove(checkpoint_file)
 
-# 변경 사항 커밋
-target_conn.commit()
+# 테이블/단계별 소요 시간, 처리량, 최대 메모리 출력 및 저장 (컨테이너 크기 산정, 성능 회귀 확인용)
+instrumentation.finish_run()
 
 # 연결 종료
-source_cur.close()
-source_conn.close()
-target_cur.close()
-target_conn.close()
+source_pool.closeall()
+target_pool.closeall()
 
 print("Data copy process completed.")
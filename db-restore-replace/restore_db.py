@@ -5,13 +5,19 @@
 #CREATE EXTENSION postgis_raster;
 
 import subprocess
+import asyncio
 import os
+import re
+import json
 import time
-import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
 import csv
+import heapq
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Tuple
 import threading
+import instrumentation
 
 # 설정
 dump_file = "path/example.dump"
@@ -22,6 +28,40 @@ username = "user"
 password = "password"
 pg_restore_path = "path/pg_restore.exe"
 
+# 복원 방식
+# 'toc': pg_restore -l로 덤프 목차(TOC)를 한 번만 읽어 선택한 테이블 항목만 -L 목록 파일로 만들고
+#        pre-data(테이블 구조) → data → post-data(인덱스/제약조건/트리거) 순서로 복원
+# 'jobs': 선택한 테이블의 TOC 항목을 목록 파일 하나로 만들어 pg_restore --section 단계별로 실행
+#         (pre-data 한 번, data와 post-data는 pg_restore --jobs로 병렬 실행, custom/directory 형식 덤프만 가능)
+# 'table': 테이블마다 pg_restore를 구조/데이터 두 번씩 실행
+restore_mode = 'toc'
+toc_cache_file = f"{dump_file}.toc.json"  # 파싱한 TOC 캐시 (덤프 파일이 바뀌면 다시 읽음)
+list_dir = "path/restore_lists"  # -L 목록 파일을 만들 폴더
+
+# 데이터 복원 스케줄링 설정 (예상 소요 시간이 긴 테이블부터 배분, LPT)
+# 예상 시간은 이전 실행의 테이블별 소요 시간을 우선 사용하고, 없으면 디렉터리 형식 덤프의 데이터 파일 크기로 추정
+max_workers = 0  # 0이면 클라이언트 CPU 수와 Target 서버 여유 연결 수로 자동 결정
+target_server_cpus = None  # Target 서버 CPU 수 (알면 지정, 자동 결정 시 상한으로 사용)
+restore_timings_file = f"{dump_file}.timings.json"  # 테이블별 데이터 복원 소요 시간 기록
+estimated_restore_mb_per_sec = 50  # 소요 시간 기록이 없는 테이블의 크기 → 시간 환산 기준
+
+# 데이터 복원 실행 방식
+# 'async': asyncio 서브프로세스로 pg_restore --verbose 출력을 한 줄씩 읽어 테이블별 진행 상황을 바로 표시
+#          (테이블마다 스레드를 잡지 않으므로 동시 실행 수를 크게 늘릴 수 있고, Ctrl-C 시 실행 중인 pg_restore를 모두 종료)
+# 'thread': ThreadPoolExecutor에서 subprocess.run으로 실행 (출력은 프로세스 종료 후 한 번에 확인)
+data_runner = 'async'
+async_max_concurrency = 0  # async 모드 동시 실행 수 (0이면 max_workers 자동 결정 값 사용)
+table_restore_timeout_sec = 0  # 테이블 하나의 데이터 복원 제한 시간 (0이면 제한 없음)
+terminate_grace_sec = 5  # 중단 시 pg_restore 종료를 기다리는 시간 (지나면 강제 종료)
+max_output_line_bytes = 4096  # pg_restore 출력 한 줄의 최대 길이 (넘는 부분은 잘라서 출력)
+
+# 계측 결과 저장 (테이블/단계별 소요 시간, MB/초, 최대 메모리)
+# 데이터 크기는 디렉터리 형식 덤프의 테이블 데이터 파일 크기(압축 상태) 기준이며, pg_restore는 행 수를 알려 주지 않으므로 행/초는 기록하지 않음
+metrics_jsonl_file = f"{dump_file}.metrics.jsonl"  # 테이블마다 한 줄씩 추가 (None이면 저장 안 함)
+metrics_prom_file = None  # 예: "/var/lib/node_exporter/textfile/restore_db.prom" (Prometheus textfile collector)
+
+pool_max_connections = 8  # 복원 전체에서 공유하는 연결 풀 최대 크기
+
 # 환경 변수 설정
 os.environ["PGPASSWORD"] = password
 
@@ -32,17 +72,46 @@ def safe_print(*args, **kwargs):
     with print_lock:
         print(*args, **kwargs)
 
+# 복원 전체에서 공유하는 연결 풀 (처음 사용할 때 생성)
+connection_pool = None
+pool_lock = threading.Lock()
+
+def get_connection_pool() -> ThreadedConnectionPool:
+    global connection_pool
+    with pool_lock:
+        if connection_pool is None:
+            connection_pool = ThreadedConnectionPool(
+                1, pool_max_connections,
+                dbname=database_name,
+                user=username,
+                password=password,
+                host=host
+            )
+    return connection_pool
+
+# 풀에서 연결을 빌려 쓰고 반납 (기본은 autocommit)
+@contextmanager
+def pooled_connection(autocommit: bool = True):
+    pool = get_connection_pool()
+    conn = pool.getconn()
+    try:
+        if conn.autocommit != autocommit:
+            conn.autocommit = autocommit
+        yield conn
+    finally:
+        pool.putconn(conn)
+
+def close_connection_pool():
+    global connection_pool
+    with pool_lock:
+        if connection_pool is not None:
+            connection_pool.closeall()
+            connection_pool = None
+
 # 스키마 존재 여부 확인 및 생성을 위한 함수
 def drop_existing_tables_and_schemas(schemas: set):
     try:
-        conn = psycopg2.connect(
-            dbname=database_name,
-            user=username,
-            password=password,
-            host=host
-        )
-        conn.autocommit = True
-        with conn.cursor() as cursor:
+        with pooled_connection() as conn, conn.cursor() as cursor:
             for schema in schemas:
                 # Drop all tables in schema
                 cursor.execute(f"""
@@ -58,7 +127,6 @@ def drop_existing_tables_and_schemas(schemas: set):
                 # Drop schema
                 cursor.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
                 safe_print(f"스키마 {schema}와 관련 테이블들이 제거되었습니다.")
-        conn.close()
     except Exception as e:
         safe_print(f"스키마와 테이블 제거 중 오류 발생: {e}")
 
@@ -67,14 +135,7 @@ def ensure_schemas_exist(schemas: set):
         # 먼저 기존 스키마와 테이블 제거
         drop_existing_tables_and_schemas(schemas)
         
-        conn = psycopg2.connect(
-            dbname=database_name,
-            user=username,
-            password=password,
-            host=host
-        )
-        conn.autocommit = True
-        with conn.cursor() as cursor:
+        with pooled_connection() as conn, conn.cursor() as cursor:
             # public 스키마 먼저 생성
             cursor.execute("CREATE SCHEMA IF NOT EXISTS public;")
             
@@ -86,7 +147,6 @@ def ensure_schemas_exist(schemas: set):
                 # 스키마 권한 부여
                 cursor.execute(f'GRANT ALL ON SCHEMA "{schema}" TO postgres;')
                 cursor.execute(f'GRANT USAGE ON SCHEMA "{schema}" TO postgres;')
-        conn.close()
     except Exception as e:
         safe_print(f"스키마 생성 중 오류 발생: {e}")
         raise  # 에러를 상위로 전파하여 프로그램 중단
@@ -127,18 +187,7 @@ def restore_table_structure(schema: str, table: str) -> bool:
         return False
 
 def restore_table_data(schema: str, table: str) -> bool:
-    command = [
-        pg_restore_path,
-        "--host", host,
-        "--username", username,
-        "--dbname", database_name,
-        "--no-owner",
-        "--schema", schema,
-        "--table", table,
-        "--data-only",
-        "--verbose",
-        dump_file
-    ]
+    command = table_data_command(schema, table)
     try:
         result = subprocess.run(
             command, 
@@ -156,30 +205,473 @@ def restore_table_data(schema: str, table: str) -> bool:
         safe_print(f"{schema}.{table} 예기치 못한 오류: {e}")
         return False
 
-def check_table_exists(schema: str, table: str) -> bool:
+# ---------------------------
+# 덤프 TOC 기반 복원 계획
+# ---------------------------
+# pg_restore -l 출력 한 줄: "3456; 1259 16400 TABLE public mytable owner"
+TOC_LINE_PATTERN = re.compile(r'^(\d+);\s+(\d+)\s+(\d+)\s+(.*)$')
+# 여러 단어로 된 항목 종류를 먼저 비교해야 "TABLE DATA"가 "TABLE"로 잘리지 않음
+TOC_DESCS = ["TABLE DATA", "FK CONSTRAINT", "CONSTRAINT", "INDEX", "TRIGGER", "TABLE"]
+# post-data SQL의 인덱스 생성문에서 인덱스가 속한 테이블 확인 (TOC의 INDEX 항목에는 테이블 이름이 없음)
+INDEX_DDL_PATTERN = re.compile(r'^CREATE (?:UNIQUE )?INDEX (\S+) ON (?:ONLY )?(\S+?)\.(\S+) USING', re.MULTILINE)
+
+def pg_restore_command(*args):
+    return [
+        pg_restore_path,
+        "--host", host,
+        "--username", username,
+        "--dbname", database_name,
+        "--no-owner",
+        *args,
+        dump_file
+    ]
+
+def table_data_command(schema: str, table: str):
+    return pg_restore_command("--schema", schema, "--table", table, "--data-only", "--verbose")
+
+def strip_quotes(name: str) -> str:
+    return name[1:-1] if name.startswith('"') and name.endswith('"') else name
+
+def parse_toc_line(line: str):
+    match = TOC_LINE_PATTERN.match(line.strip())
+    if not match:
+        return None
+    rest = match.group(4)
+    for desc in TOC_DESCS:
+        if rest.startswith(desc + " "):
+            tokens = rest[len(desc) + 1:].split(" ")
+            # 소유자 없이 덤프한 경우 마지막 토큰이 소유자가 아닐 수 있으나 이 도구가 쓰는 종류는 모두 소유자가 있음
+            return {
+                'line': line.strip(),
+                'dump_id': int(match.group(1)),
+                'desc': desc,
+                'schema': tokens[0],
+                'tag': " ".join(tokens[1:-1]),
+            }
+    return {'line': line.strip(), 'desc': None, 'schema': None, 'tag': rest}
+
+# 덤프 TOC와 인덱스-테이블 매핑을 읽어 캐시에 저장 (덤프 파일 크기/수정 시각이 같으면 캐시 사용)
+def load_dump_toc() -> dict:
+    dump_stat = os.stat(dump_file)
+    signature = {'size': dump_stat.st_size, 'mtime': dump_stat.st_mtime}
+    if os.path.exists(toc_cache_file):
+        with open(toc_cache_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('signature') == signature:
+            safe_print(f"덤프 TOC 캐시를 사용합니다: {toc_cache_file}")
+            return cached
+
+    result = subprocess.run([pg_restore_path, "-l", dump_file], check=True, text=True,
+                            capture_output=True, encoding='utf-8')
+    entries = [entry for entry in (parse_toc_line(line) for line in result.stdout.splitlines()) if entry]
+
+    # post-data 구간 SQL만 출력하여 인덱스가 속한 테이블을 확인 (데이터는 읽지 않음)
+    result = subprocess.run([pg_restore_path, "--section=post-data", "-f", "-", dump_file], check=True, text=True,
+                            capture_output=True, encoding='utf-8')
+    index_tables = {
+        f"{strip_quotes(schema)}.{strip_quotes(index_name)}": strip_quotes(table)
+        for index_name, schema, table in INDEX_DDL_PATTERN.findall(result.stdout)
+    }
+
+    toc = {'signature': signature, 'entries': entries, 'index_tables': index_tables}
+    with open(toc_cache_file, 'w', encoding='utf-8') as f:
+        json.dump(toc, f, ensure_ascii=False)
+    safe_print(f"덤프 TOC {len(entries)}개 항목을 읽었습니다.")
+    return toc
+
+# 선택한 테이블에 해당하는 TOC 항목을 단계별로 분류
+# CONSTRAINT/FK CONSTRAINT/TRIGGER 항목의 tag는 "테이블 이름 객체 이름" 형식
+def build_restore_plan(toc: dict, tables: List[Tuple[str, str]]) -> dict:
+    selected = set(tables)
+    plan = {'pre-data': [], 'structure': [], 'data': {}, 'data_ids': {}, 'post-data': []}
+    for entry in toc['entries']:
+        desc = entry['desc']
+        if desc is None:
+            continue
+        schema = strip_quotes(entry['schema'])
+        if desc == 'TABLE':
+            if (schema, strip_quotes(entry['tag'])) in selected:
+                plan['pre-data'].append(entry['line'])
+                plan['structure'].append((schema, strip_quotes(entry['tag'])))
+        elif desc == 'TABLE DATA':
+            if (schema, strip_quotes(entry['tag'])) in selected:
+                plan['data'][(schema, strip_quotes(entry['tag']))] = entry['line']
+                plan['data_ids'][(schema, strip_quotes(entry['tag']))] = entry.get('dump_id')
+        elif desc == 'INDEX':
+            table = toc['index_tables'].get(f"{schema}.{strip_quotes(entry['tag'])}")
+            if (schema, table) in selected:
+                plan['post-data'].append(entry['line'])
+        elif (schema, strip_quotes(entry['tag'].split(" ")[0])) in selected:
+            plan['post-data'].append(entry['line'])
+    return plan
+
+def write_list_file(name: str, lines: List[str]) -> str:
+    os.makedirs(list_dir, exist_ok=True)
+    path = os.path.join(list_dir, name)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+# pg_restore는 무시한 오류가 하나라도 있으면 0이 아닌 코드로 끝나므로, pre-data가 실패해도 전체를 멈추지 않고
+# 실제로 만들어진 테이블만 남긴 복원 계획으로 데이터/post-data를 계속 복원 (만들지 못한 테이블은 실패로 기록)
+def plan_for_created_tables(toc: dict, plan: dict, pre_data_ok: bool) -> dict:
+    if pre_data_ok:
+        return plan
+    created = check_tables_exist(plan['structure'])
+    failed = [f"{schema}.{table}" for schema, table in plan['structure'] if (schema, table) not in created]
+    if failed:
+        safe_print(f"구조 복원에 실패한 테이블 {len(failed)}개는 데이터/인덱스 복원에서 제외합니다: {', '.join(failed)}")
+        for table_key in failed:
+            instrumentation.finish_table(table_key, 'failed')
+    return build_restore_plan(toc, [table for table in plan['structure'] if table in created])
+
+# -L 목록 파일 하나로 pg_restore 실행 (extra_args로 --section, --jobs 등을 추가)
+def restore_from_list(label: str, list_file: str, *extra_args) -> bool:
+    command = pg_restore_command("--use-list", list_file, *extra_args, "--verbose")
     try:
-        conn = psycopg2.connect(
-            dbname=database_name,
-            user=username,
-            password=password,
-            host=host
-        )
-        with conn.cursor() as cursor:
-            cursor.execute(f"""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_schema = '{schema}' 
-                    AND table_name = '{table}'
-                );
+        subprocess.run(command, check=True, text=True, capture_output=True, encoding='utf-8')
+        safe_print(f"{label} 복원 완료")
+        return True
+    except subprocess.CalledProcessError as e:
+        safe_print(f"{label} 복원 실패: {e.stderr}")
+        return False
+    except Exception as e:
+        safe_print(f"{label} 예기치 못한 오류: {e}")
+        return False
+
+# ---------------------------
+# 데이터 복원 스케줄링
+# ---------------------------
+timings_lock = threading.Lock()
+
+def load_restore_timings() -> dict:
+    if os.path.exists(restore_timings_file):
+        with open(restore_timings_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+def save_restore_timings(timings: dict):
+    with timings_lock:
+        with open(restore_timings_file, 'w', encoding='utf-8') as f:
+            json.dump(timings, f, ensure_ascii=False, indent=2)
+
+# 디렉터리 형식 덤프는 TABLE DATA 항목마다 <dumpId>.dat(.gz/.lz4/.zst) 파일이 있으므로 그 크기를 사용
+def dump_data_size(dump_id) -> int:
+    if dump_id is None or not os.path.isdir(dump_file):
+        return 0
+    for suffix in ("", ".gz", ".lz4", ".zst"):
+        path = os.path.join(dump_file, f"{dump_id}.dat{suffix}")
+        if os.path.exists(path):
+            return os.path.getsize(path)
+    return 0
+
+# 테이블별 예상 소요 시간(초) 계산
+# 기록도 크기도 없는 테이블은 다른 테이블 예상 시간의 평균으로 둠
+def estimate_restore_seconds(tables: List[Tuple[str, str]], data_ids: dict = None) -> dict:
+    timings = load_restore_timings()
+    estimates = {}
+    for schema, table in tables:
+        key = f"{schema}.{table}"
+        if key in timings:
+            estimates[(schema, table)] = timings[key]
+        else:
+            size = dump_data_size((data_ids or {}).get((schema, table)))
+            estimates[(schema, table)] = size / (estimated_restore_mb_per_sec * 1024 * 1024) if size else None
+    known = [seconds for seconds in estimates.values() if seconds is not None]
+    default = sum(known) / len(known) if known else 0
+    return {table: (default if seconds is None else seconds) for table, seconds in estimates.items()}
+
+# 클라이언트 CPU 수, Target 서버 CPU 수(설정 시), 서버 여유 연결 수 중 가장 작은 값으로 워커 수 결정
+def auto_tune_max_workers(table_count: int) -> int:
+    if max_workers:
+        return max_workers
+    workers = os.cpu_count() or 4
+    if target_server_cpus:
+        workers = min(workers, target_server_cpus)
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT current_setting('max_connections')::int
+                       - current_setting('superuser_reserved_connections')::int
+                       - (SELECT count(*) FROM pg_stat_activity)
             """)
-            exists = cursor.fetchone()[0]
-        conn.close()
-        return exists
+            free_connections = cursor.fetchone()[0]
+        workers = min(workers, max(free_connections - 2, 1))
+    except Exception as e:
+        safe_print(f"Target 서버 여유 연결 수 확인 실패 (CPU 수 기준으로 결정): {e}")
+    return max(1, min(workers, table_count))
+
+# 예상 시간이 긴 테이블부터 정렬하고, 가장 덜 바쁜 워커에 배정하는 방식으로 전체 소요 시간을 예측
+def schedule_longest_first(tables: List[Tuple[str, str]], estimates: dict, workers: int) -> List[Tuple[str, str]]:
+    ordered = sorted(tables, key=lambda t: estimates.get(t, 0), reverse=True)
+    loads = [0.0] * workers
+    for table in ordered:
+        heapq.heapreplace(loads, loads[0] + estimates.get(table, 0))
+    total = sum(estimates.get(t, 0) for t in tables)
+    safe_print(f"워커 {workers}개, 예상 총 작업 시간 {total:.0f}초, 예상 소요 시간(makespan) {max(loads):.0f}초")
+    return ordered
+
+# 데이터 복원 후 소요 시간을 기록 (다음 실행의 스케줄링에 사용)
+def run_timed(timings: dict, schema: str, table: str, restore_fn, *args) -> bool:
+    started = time.time()
+    success = restore_fn(*args)
+    elapsed = time.time() - started
+    instrumentation.record_phase(f"{schema}.{table}", 'data', elapsed)
+    instrumentation.finish_table(f"{schema}.{table}", 'done' if success else 'failed')
+    if success:
+        with timings_lock:
+            timings[f"{schema}.{table}"] = round(elapsed, 2)
+    return success
+
+# 데이터 복원 동시 실행 수 (async 모드에서 async_max_concurrency를 지정하면 그 값을 사용)
+def data_concurrency(table_count: int) -> int:
+    if data_runner == 'async' and async_max_concurrency:
+        return max(1, min(async_max_concurrency, table_count))
+    return auto_tune_max_workers(table_count)
+
+# ---------------------------
+# asyncio 기반 데이터 복원
+# ---------------------------
+# pg_restore --verbose 출력 한 줄: "pg_restore: processing data for table "public.mytable""
+VERBOSE_LINE_PATTERN = re.compile(r'^pg_restore: (?:(error|warning): )?(.*)$')
+
+# stderr를 일정 크기씩 읽어 줄 단위로 나눔
+# StreamReader의 줄 단위 읽기는 기본 한도(64 KiB)를 넘는 줄(geometry 행이 포함된 COPY 오류 등)에서 ValueError를 내므로
+# 직접 나누고, max_output_line_bytes를 넘는 줄은 앞부분만 남김 (줄 앞의 "pg_restore: error:"는 유지됨)
+async def read_output_lines(stream):
+    buffer = b''
+    truncated = False
+    while True:
+        chunk = await stream.read(65536)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            if truncated:
+                truncated = False
+                continue
+            yield line if len(line) <= max_output_line_bytes else line[:max_output_line_bytes] + b' ...'
+        # 줄바꿈 없이 한도를 넘으면 앞부분만 먼저 내보내고 나머지는 줄바꿈까지 버림
+        if len(buffer) > max_output_line_bytes:
+            if not truncated:
+                yield buffer[:max_output_line_bytes] + b' ...'
+                truncated = True
+            buffer = b''
+    if buffer and not truncated:
+        yield buffer
+
+# 실행 중인 pg_restore 종료 (terminate 후 기다려도 끝나지 않으면 kill)
+async def stop_process(process):
+    if process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), terminate_grace_sec)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+# pg_restore를 실행하고 stderr를 한 줄씩 읽어 진행 상황에 반영 (종료 코드와 오류 줄 반환)
+# 제한 시간 초과나 Ctrl-C로 취소되면 finally에서 프로세스를 종료
+async def stream_pg_restore(label: str, command: List[str], state: dict) -> Tuple[int, List[str]]:
+    process = await asyncio.create_subprocess_exec(
+        *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    errors = []
+    try:
+        async for raw_line in read_output_lines(process.stderr):
+            line = raw_line.decode('utf-8', errors='replace').rstrip()
+            match = VERBOSE_LINE_PATTERN.match(line)
+            if not match:
+                continue
+            level, message = match.groups()
+            if level == 'error':
+                errors.append(message)
+            state['last'] = message
+            safe_print(f"[{label}] {line}")
+        return await process.wait(), errors
+    finally:
+        await stop_process(process)
+
+async def restore_table_async(schema: str, table: str, command: List[str], semaphore: asyncio.Semaphore,
+                              progress: dict, timings: dict) -> Tuple[Tuple[str, str], bool]:
+    label = f"{schema}.{table}"
+    state = progress[label]
+    async with semaphore:
+        state['status'] = 'running'
+        started = time.time()
+        try:
+            restore = stream_pg_restore(label, command, state)
+            if table_restore_timeout_sec:
+                returncode, errors = await asyncio.wait_for(restore, table_restore_timeout_sec)
+            else:
+                returncode, errors = await restore
+        except asyncio.TimeoutError:
+            state['status'] = 'timeout'
+            safe_print(f"{label} 데이터 복원 제한 시간({table_restore_timeout_sec}초) 초과로 중단")
+            instrumentation.finish_table(label, 'timeout')
+            return (schema, table), False
+        except Exception as e:
+            state['status'] = 'failed'
+            safe_print(f"{label} 예기치 못한 오류: {e}")
+            instrumentation.finish_table(label, 'failed')
+            return (schema, table), False
+
+    elapsed = time.time() - started
+    instrumentation.record_phase(label, 'data', elapsed)
+    instrumentation.finish_table(label, 'done' if returncode == 0 else 'failed')
+    if returncode == 0:
+        state['status'] = 'done'
+        timings[label] = round(elapsed, 2)
+        safe_print(f"{label} 데이터 복원 완료 ({elapsed:.1f}초)")
+        return (schema, table), True
+    state['status'] = 'failed'
+    safe_print(f"{label} 데이터 복원 실패 (종료 코드 {returncode}): {' / '.join(errors) or state['last']}")
+    return (schema, table), False
+
+# jobs 순서(LPT)대로 시작하고 동시 실행 수는 세마포어로 제한
+# 취소되면 남은 작업을 모두 취소하고 각 작업의 pg_restore가 종료될 때까지 기다림
+async def run_restores_async(jobs: List[Tuple[str, str, List[str]]], timings: dict, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = {f"{schema}.{table}": {'status': 'waiting', 'last': ''} for schema, table, _ in jobs}
+    tasks = [
+        asyncio.ensure_future(restore_table_async(schema, table, command, semaphore, progress, timings))
+        for schema, table, command in jobs
+    ]
+    results = {}
+    try:
+        for finished, next_result in enumerate(asyncio.as_completed(tasks), 1):
+            table_key, success = await next_result
+            results[table_key] = success
+            statuses = [state['status'] for state in progress.values()]
+            safe_print(f"진행: {finished}/{len(tasks)} 완료, 실행 중 {statuses.count('running')}, "
+                       f"실패 {statuses.count('failed') + statuses.count('timeout')}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return results
+
+# 동기 코드에서 호출하는 진입점 (Ctrl-C 시 그때까지의 소요 시간 기록을 저장하고 중단)
+def restore_data_async(jobs: List[Tuple[str, str, List[str]]], timings: dict, concurrency: int) -> dict:
+    try:
+        return asyncio.run(run_restores_async(jobs, timings, concurrency))
+    except KeyboardInterrupt:
+        safe_print("\n사용자 중단: 실행 중인 pg_restore를 모두 종료했습니다.")
+        save_restore_timings(timings)
+        raise
+
+# TOC를 한 번만 읽고 pre-data → data(테이블별 병렬) → post-data 순서로 복원
+def toc_restore(tables: List[Tuple[str, str]]):
+    unique_schemas = {schema for schema, _ in tables}
+    try:
+        ensure_schemas_exist(unique_schemas)
+    except Exception as e:
+        safe_print(f"스키마 생성 실패로 프로그램을 종료합니다: {e}")
+        return
+
+    with instrumentation.phase(None, 'introspect'):
+        toc = load_dump_toc()
+        plan = build_restore_plan(toc, tables)
+    missing = [f"{schema}.{table}" for schema, table in tables if (schema, table) not in plan['data']]
+    if missing:
+        safe_print(f"덤프에 데이터가 없는 테이블: {', '.join(missing)}")
+
+    # 1. 테이블 구조 (한 번의 pg_restore)
+    safe_print(f"\n=== 테이블 구조 복원 ({len(plan['pre-data'])} 항목) ===")
+    with instrumentation.phase(None, 'ddl'):
+        if plan['pre-data']:
+            pre_data_ok = restore_from_list("pre-data", write_list_file("pre_data.list", plan['pre-data']))
+            plan = plan_for_created_tables(toc, plan, pre_data_ok)
+
+    # 2. 데이터 (테이블별 목록 파일로 병렬 복원, 오래 걸리는 테이블부터)
+    safe_print(f"\n=== 데이터 병렬 복원 시작 ({len(plan['data'])} 테이블) ===")
+    data_tables = list(plan['data'])
+    workers = data_concurrency(len(data_tables))
+    ordered = schedule_longest_first(data_tables, estimate_restore_seconds(data_tables, plan['data_ids']), workers)
+    timings = load_restore_timings()
+    for schema, table in ordered:
+        instrumentation.add_bytes(f"{schema}.{table}", dump_data_size(plan['data_ids'].get((schema, table))))
+    list_files = {
+        (schema, table): write_list_file(f"data_{schema}.{table}.list", [plan['data'][(schema, table)]])
+        for schema, table in ordered
+    }
+    if data_runner == 'async':
+        jobs = [(schema, table, pg_restore_command("--use-list", list_files[(schema, table)], "--verbose"))
+                for schema, table in ordered]
+        restore_data_async(jobs, timings, workers)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            future_to_table = {
+                executor.submit(run_timed, timings, schema, table, restore_from_list, f"{schema}.{table} 데이터",
+                                list_files[(schema, table)]): (schema, table)
+                for schema, table in ordered
+            }
+            for future in as_completed(future_to_table):
+                schema, table = future_to_table[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    safe_print(f"{schema}.{table} 처리 중 오류 발생: {e}")
+    save_restore_timings(timings)
+
+    # 3. 인덱스/제약조건/트리거 (데이터 적재 후 한 번의 pg_restore)
+    safe_print(f"\n=== 인덱스/제약조건 복원 ({len(plan['post-data'])} 항목) ===")
+    if plan['post-data']:
+        with instrumentation.phase(None, 'index'):
+            restore_from_list("post-data", write_list_file("post_data.list", plan['post-data']))
+
+# pg_restore --jobs로 단계별 복원
+# 인덱스/제약조건은 모든 데이터 적재가 끝난 뒤 마지막 단계에서 병렬로 생성 (GiST 인덱스가 많은 테이블에 유리)
+def jobs_restore(tables: List[Tuple[str, str]]):
+    unique_schemas = {schema for schema, _ in tables}
+    try:
+        ensure_schemas_exist(unique_schemas)
+    except Exception as e:
+        safe_print(f"스키마 생성 실패로 프로그램을 종료합니다: {e}")
+        return
+
+    with instrumentation.phase(None, 'introspect'):
+        toc = load_dump_toc()
+        plan = build_restore_plan(toc, tables)
+    selected_lines = set(plan['pre-data']) | set(plan['data'].values()) | set(plan['post-data'])
+    # 목록 파일은 덤프 TOC 순서를 그대로 유지해야 의존 관계대로 복원됨
+    list_file = write_list_file("selected.list", [entry['line'] for entry in toc['entries'] if entry['line'] in selected_lines])
+    jobs = auto_tune_max_workers(max(len(plan['data']), 1))
+
+    safe_print(f"\n=== 테이블 구조 복원 ({len(plan['pre-data'])} 항목) ===")
+    with instrumentation.phase(None, 'ddl'):
+        pre_data_ok = restore_from_list("pre-data", list_file, "--section=pre-data")
+        if not pre_data_ok:
+            # 만들어진 테이블만으로 목록 파일을 다시 작성
+            plan = plan_for_created_tables(toc, plan, pre_data_ok)
+            selected_lines = set(plan['data'].values()) | set(plan['post-data'])
+            list_file = write_list_file("selected.list", [entry['line'] for entry in toc['entries'] if entry['line'] in selected_lines])
+    safe_print(f"\n=== 데이터 병렬 복원 ({len(plan['data'])} 테이블, --jobs {jobs}) ===")
+    with instrumentation.phase(None, 'data'):
+        # 일부 테이블의 데이터 오류로 종료 코드가 0이 아니어도 나머지 테이블의 인덱스/제약조건은 계속 생성
+        if not restore_from_list("data", list_file, "--section=data", "--jobs", str(jobs)):
+            safe_print("데이터 복원 중 오류가 있었습니다. 인덱스/제약조건 복원은 계속 진행합니다.")
+    safe_print(f"\n=== 인덱스/제약조건 병렬 생성 ({len(plan['post-data'])} 항목, --jobs {jobs}) ===")
+    with instrumentation.phase(None, 'index'):
+        restore_from_list("post-data", list_file, "--section=post-data", "--jobs", str(jobs))
+
+# 테이블 목록 전체의 존재 여부를 쿼리 한 번으로 확인 (존재하는 (스키마, 테이블) 집합 반환)
+def check_tables_exist(tables: List[Tuple[str, str]]) -> set:
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT t.schema_name, t.table_name
+                FROM unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+                WHERE to_regclass(format('%%I.%%I', t.schema_name, t.table_name)) IS NOT NULL
+            """, ([schema for schema, _ in tables], [table for _, table in tables]))
+            return {(schema, table) for schema, table in cursor.fetchall()}
     except Exception as e:
         safe_print(f"테이블 존재 여부 확인 중 오류 발생: {e}")
-        return False
+        return set()
 
-def parallel_restore(tables: List[Tuple[str, str]], max_workers: int = 4):
+def parallel_restore(tables: List[Tuple[str, str]]):
     # 1. 먼저 모든 고유한 스키마를 확인
     unique_schemas = {schema for schema, _ in tables}
     try:
@@ -191,78 +683,83 @@ def parallel_restore(tables: List[Tuple[str, str]], max_workers: int = 4):
     
     # 2. 테이블별로 처리
     structure_results = []
+    with instrumentation.phase(None, 'introspect'):
+        existing_tables = check_tables_exist(tables)
     for schema, table in tables:
-        table_exists = check_table_exists(schema, table)
-        if table_exists:
+        if (schema, table) in existing_tables:
             safe_print(f"{schema}.{table} 테이블이 이미 존재합니다. 데이터만 복원합니다.")
             structure_results.append((schema, table, True))
         else:
             safe_print(f"{schema}.{table} 테이블 구조를 복원합니다.")
-            success = restore_table_structure(schema, table)
+            with instrumentation.phase(f"{schema}.{table}", 'ddl'):
+                success = restore_table_structure(schema, table)
             structure_results.append((schema, table, success))
+            if not success:
+                instrumentation.finish_table(f"{schema}.{table}", 'failed')
     
     # 3. 성공한 테이블만 데이터 복원
     successful_tables = [(schema, table) for schema, table, success in structure_results if success]
     safe_print(f"\n=== 데이터 병렬 복원 시작 ({len(successful_tables)} 테이블) ===")
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_table = {
-            executor.submit(restore_table_data, schema, table): (schema, table)
-            for schema, table in successful_tables
-        }
-        for future in as_completed(future_to_table):
-            schema, table = future_to_table[future]
-            try:
-                success = future.result()
-                if success:
-                    safe_print(f"{schema}.{table} 데이터 복원 완료")
-                else:
-                    safe_print(f"{schema}.{table} 데이터 복원 실패")
-            except Exception as e:
-                safe_print(f"{schema}.{table} 처리 중 오류 발생: {e}")
+
+    # 이전 실행 기록 기준으로 오래 걸리는 테이블부터 배분
+    workers = data_concurrency(len(successful_tables))
+    ordered = schedule_longest_first(successful_tables, estimate_restore_seconds(successful_tables), workers)
+    timings = load_restore_timings()
+    if data_runner == 'async':
+        jobs = [(schema, table, table_data_command(schema, table)) for schema, table in ordered]
+        restore_data_async(jobs, timings, workers)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            future_to_table = {
+                executor.submit(run_timed, timings, schema, table, restore_table_data, schema, table): (schema, table)
+                for schema, table in ordered
+            }
+            for future in as_completed(future_to_table):
+                schema, table = future_to_table[future]
+                try:
+                    success = future.result()
+                    if success:
+                        safe_print(f"{schema}.{table} 데이터 복원 완료")
+                    else:
+                        safe_print(f"{schema}.{table} 데이터 복원 실패")
+                except Exception as e:
+                    safe_print(f"{schema}.{table} 처리 중 오류 발생: {e}")
+    save_restore_timings(timings)
 
 def ensure_postgis_extension():
     try:
-        conn = psycopg2.connect(
-            dbname=database_name,
-            user=username,
-            password=password,
-            host=host
-        )
-        conn.autocommit = True
-        with conn.cursor() as cursor:
+        with pooled_connection() as conn, conn.cursor() as cursor:
             # Create extension in public schema first
             cursor.execute("CREATE SCHEMA IF NOT EXISTS public;")
             cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis SCHEMA public;")
             # Set search path to include public schema
             cursor.execute("SET search_path TO public, pg_catalog;")
             safe_print("PostGIS 확장이 활성화되었습니다.")
-        conn.close()
     except Exception as e:
         safe_print(f"PostGIS 활성화 중 오류 발생: {e}")
         
 def main():
     start_time = time.time()
+    instrumentation.start_run('restore_db', metrics_jsonl_file, metrics_prom_file)
     # Ensure PostGIS is set up before any restore operations
     ensure_postgis_extension()
     
     # Set up connection and search path for all operations
-    conn = psycopg2.connect(
-        dbname=database_name,
-        user=username,
-        password=password,
-        host=host
-    )
-    conn.autocommit = True
-    with conn.cursor() as cursor:
+    with pooled_connection() as conn, conn.cursor() as cursor:
         cursor.execute("SET search_path TO public, pg_catalog;")
-    conn.close()
     
     tables_to_restore = load_table_lists(table_list_file)
     total_tables = len(tables_to_restore)
     
     safe_print(f"총 {total_tables}개의 테이블 복원을 시작합니다...")
-    parallel_restore(tables_to_restore)
+    if restore_mode == 'toc':
+        toc_restore(tables_to_restore)
+    elif restore_mode == 'jobs':
+        jobs_restore(tables_to_restore)
+    else:
+        parallel_restore(tables_to_restore)
+    close_connection_pool()
+    instrumentation.finish_run()
     
     end_time = time.time()
     elapsed_time = end_time - start_time
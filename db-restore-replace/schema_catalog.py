@@ -0,0 +1,142 @@
+import json
+import os
+import re
+
+# ---------------------------
+# 테이블 목록 전체의 카탈로그 정보를 한 번에 조회하는 모듈
+# move_table.py, change_dbname.py, show_two_table_data_count.py에서 공통으로 사용
+# ---------------------------
+
+# information_schema 대신 pg_catalog를 직접 조회하여 테이블 목록 전체를 한 번의 쿼리로 가져옴
+# 컬럼 정의(typmod 포함), PK, 인덱스/제약조건 DDL, 크기 추정값을 테이블당 한 행으로 반환
+CATALOG_QUERY = """
+SELECT
+    t.schema_name,
+    t.table_name,
+    c.oid IS NOT NULL AS table_exists,
+    c.relpersistence = 'u' AS unlogged,
+    c.reltuples::bigint AS reltuples,
+    c.relpages,
+    c.relallvisible,
+    CASE WHEN c.oid IS NOT NULL THEN pg_total_relation_size(c.oid) END AS size_bytes,
+    (
+        SELECT json_agg(json_build_object(
+                   'name', a.attname,
+                   'type', format_type(a.atttypid, a.atttypmod),
+                   'base_type', ty.typname,
+                   'typmod', a.atttypmod,
+                   'not_null', a.attnotnull
+               ) ORDER BY a.attnum)
+        FROM pg_attribute a
+        JOIN pg_type ty ON ty.oid = a.atttypid
+        WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped
+    ) AS columns,
+    (
+        SELECT json_agg(a.attname ORDER BY array_position(x.indkey::int2[], a.attnum))
+        FROM pg_index x
+        JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = ANY(x.indkey)
+        WHERE x.indrelid = c.oid AND x.indisprimary
+    ) AS primary_key,
+    (
+        SELECT json_agg(json_build_object(
+                   'name', i.relname,
+                   'definition', pg_get_indexdef(x.indexrelid),
+                   'constraint_name', con.conname,
+                   'constraint_type', con.contype,
+                   'constraint_definition', pg_get_constraintdef(con.oid)
+               ) ORDER BY x.indisprimary DESC, i.relname)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        LEFT JOIN pg_constraint con ON con.conindid = x.indexrelid AND con.conrelid = x.indrelid
+                                   AND con.contype IN ('p', 'u', 'x')
+        WHERE x.indrelid = c.oid
+    ) AS indexes
+FROM unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+LEFT JOIN pg_namespace n ON n.nspname = t.schema_name
+LEFT JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.table_name AND c.relkind IN ('r', 'p');
+"""
+
+INTEGER_TYPES = ('smallint', 'integer', 'bigint')
+
+# geometry(MultiPolygon,4326) 형태에서 도형 타입과 SRID 추출
+GEOMETRY_TYPE_PATTERN = re.compile(r'^(geometry|geography)\((\w+)(?:,\s*(\d+))?\)$', re.IGNORECASE)
+
+def table_key(schema_name, table_name):
+    return f"{schema_name}.{table_name}"
+
+def parse_geometry_type(column_type):
+    match = GEOMETRY_TYPE_PATTERN.match(column_type)
+    if not match:
+        return None, None
+    return match.group(2), int(match.group(3)) if match.group(3) else None
+
+# 조회 결과 한 행을 스키마 모델(dict)로 변환
+def build_entry(row):
+    (schema_name, table_name, table_exists, unlogged, reltuples, relpages, relallvisible,
+     size_bytes, columns, primary_key, indexes) = row
+    columns = columns or []
+    for column in columns:
+        column['geometry_type'], column['srid'] = parse_geometry_type(column['type'])
+    return {
+        'schema': schema_name,
+        'table': table_name,
+        'exists': table_exists,
+        'unlogged': bool(unlogged),
+        'reltuples': reltuples,
+        'relpages': relpages,
+        'relallvisible': relallvisible,
+        'size_bytes': size_bytes or 0,
+        'columns': columns,
+        'primary_key': primary_key or [],
+        'indexes': indexes or [],
+    }
+
+# 테이블 목록 전체의 스키마 모델을 반환 ({"schema.table": entry})
+# cache_file이 있고 요청한 테이블이 모두 들어 있으면 DB를 조회하지 않고 파일을 사용
+# (크기/행 수 추정값은 저장 시점 기준이므로 필요하면 refresh=True로 다시 조회)
+def load_schema_catalog(conn, tables, cache_file=None, refresh=False):
+    keys = [table_key(schema, table) for schema, table in tables]
+    if cache_file and not refresh and os.path.exists(cache_file):
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if all(key in cached for key in keys):
+            print(f"Loaded schema catalog for {len(keys)} tables from {cache_file}")
+            return {key: cached[key] for key in keys}
+
+    with conn.cursor() as cur:
+        cur.execute(CATALOG_QUERY, ([schema for schema, _ in tables], [table for _, table in tables]))
+        catalog = {table_key(row[0], row[1]): build_entry(row) for row in cur.fetchall()}
+    conn.commit()
+    print(f"Loaded schema catalog for {len(catalog)} tables in one query")
+
+    if cache_file:
+        temp_file = f"{cache_file}.tmp"
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(catalog, f, ensure_ascii=False, indent=2)
+        os.replace(temp_file, cache_file)
+    return catalog
+
+# CREATE TABLE용 컬럼 정의 문자열 (columns를 주면 해당 컬럼만)
+def column_definitions(entry, columns=None):
+    definitions = []
+    for column in entry['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+        definition = f"{column['name']} {column['type']}"
+        if column['not_null']:
+            definition += " NOT NULL"
+        definitions.append(definition)
+    return ", ".join(definitions)
+
+def column_names(entry):
+    return [column['name'] for column in entry['columns']]
+
+# 정수형 단일 컬럼 PK 이름 (없으면 None)
+def integer_pk(entry):
+    if len(entry['primary_key']) != 1:
+        return None
+    pk_column = entry['primary_key'][0]
+    for column in entry['columns']:
+        if column['name'] == pk_column and column['type'] in INTEGER_TYPES:
+            return pk_column
+    return None
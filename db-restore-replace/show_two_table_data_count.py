@@ -1,6 +1,12 @@
+import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
+from schema_catalog import load_schema_catalog, column_names, integer_pk
+import instrumentation
 
 # CSV 파일 읽기 및 결과 파일 설정
 csv_file = "C:/문서/UDS/table_list.csv"  # CSV 파일 경로
@@ -20,66 +26,317 @@ target_password = 'dds123!@#'
 # target_user = 'postgres'
 # target_password = 'mysecretpassword'
 
-# Target DB 연결
-target_conn = psycopg2.connect(host=target_host, dbname=target_dbname, user=target_user, password=target_password)
-target_cur = target_conn.cursor()
+# 검증 방식 설정
+# 'estimate': pg_class 통계(reltuples, 현재 페이지 수)로 즉시 추정, 전체 목록을 쿼리 한 번으로 조회
+# 'exact': COUNT(*)를 연결 풀에서 병렬 실행
+# 'checksum': PK 범위별로 행 해시의 합(순서 무관)을 원본/백업 테이블에서 동시에 계산하여 내용까지 비교하고,
+#             값이 다른 범위만 다시 조회하여 차이 나는 PK를 기록 (정수형 단일 PK가 없으면 테이블 전체를 한 범위로 비교)
+count_mode = 'exact'
+count_workers = 4  # exact/checksum 모드에서 동시에 검증할 테이블 수
+checksum_chunk_size = 100000  # checksum 모드에서 체크섬을 계산할 PK 범위 크기 (키 값 기준)
+max_reported_keys = 100  # 테이블당 결과에 기록할 차이 나는 PK 최대 개수
+statement_timeout_ms = 600000  # 쿼리 하나의 최대 실행 시간 (0이면 제한 없음)
+backup_suffix = "_back0115"
 
-# 결과를 저장할 리스트
-results = []
+# 계측 결과 저장 (테이블별 검증 시간, 초당 검증 행 수(원본+백업), 최대 메모리)
+metrics_jsonl_file = "C:/문서/UDS/compare_metrics.jsonl"  # 테이블마다 한 줄씩 추가 (None이면 저장 안 함)
+metrics_prom_file = None  # 예: "/var/lib/node_exporter/textfile/compare.prom" (Prometheus textfile collector)
 
-# 테이블의 레코드 수를 비교하는 함수
-def compare_table_counts(schema_name, table_name):
-    try:
-        # 원본 테이블의 레코드 수 조회 (Target DB)
-        target_cur.execute(f"SELECT COUNT(*) FROM {schema_name}.{table_name}")
-        original_count = target_cur.fetchone()[0]
-
-        # 백업 테이블의 레코드 수 조회 (Target DB)
-        backup_table = f"{table_name}_back0115"
-        target_cur.execute(f"SELECT COUNT(*) FROM {schema_name}.{backup_table}")
-        backup_count = target_cur.fetchone()[0]
-
-        # 결과 출력 및 저장
-        print(f"\n{schema_name}.{table_name}:")
-        print(f"Original table count: {original_count:,}")
-        print(f"Backup table count: {backup_count:,}")
+# 결과 CSV 컬럼 (all_visible 비율은 estimate 모드에서만 채워짐)
+result_fields = [
+    'schema_name', 'table_name', 'original_count', 'backup_count',
+    'original_all_visible', 'backup_all_visible', 'mismatched_ranges', 'differing_keys',
+    'count_mode', 'check_date', 'error_message'
+]
+
+# 스레드 안전한 출력/결과 기록을 위한 락
+print_lock = threading.Lock()
+
+# reltuples는 마지막 VACUUM/ANALYZE 시점의 행 수이므로 현재 페이지 수 비율로 보정 (플래너와 같은 방식)
+# relallvisible / relpages는 visibility map 기준 all-visible 페이지 비율 (1에 가까울수록 통계가 최신)
+ESTIMATE_QUERY = """
+SELECT
+    t.schema_name,
+    t.table_name,
+    CASE
+        WHEN c.oid IS NULL THEN NULL
+        WHEN c.reltuples < 0 THEN NULL
+        WHEN c.relpages = 0 THEN c.reltuples
+        ELSE c.reltuples / c.relpages * (pg_relation_size(c.oid) / current_setting('block_size')::bigint)
+    END::bigint AS estimated_count,
+    round(c.relallvisible::numeric / NULLIF(c.relpages, 0), 3) AS all_visible
+FROM unnest(%s::text[], %s::text[]) AS t(schema_name, table_name)
+LEFT JOIN pg_class c ON c.oid = to_regclass(format('%%I.%%I', t.schema_name, t.table_name));
+"""
+
+def connect_options():
+    return f"-c statement_timeout={statement_timeout_ms}"
+
+# 결과를 한 행씩 바로 파일에 기록 (중간에 중단되어도 그때까지의 결과가 남음)
+def write_result(writer, result_f, result):
+    with print_lock:
+        writer.writerow(result)
+        result_f.flush()
+
+# 검증 함수 하나를 실행하며 verify 단계 시간을 기록
+def timed_verify(schema_name, table_name, check_fn, *args):
+    with instrumentation.phase(f"{schema_name}.{table_name}", 'verify'):
+        return check_fn(*args)
+
+# 검증한 행 수(원본+백업)와 성공 여부를 기록
+def record_metrics(result):
+    table_key = f"{result['schema_name']}.{result['table_name']}"
+    counts = [count for count in (result.get('original_count'), result.get('backup_count')) if isinstance(count, int)]
+    if counts:
+        instrumentation.add_rows(table_key, sum(counts))
+    instrumentation.finish_table(table_key, 'failed' if result.get('error_message') else 'done')
+
+def print_result(result):
+    with print_lock:
+        print(f"\n{result['schema_name']}.{result['table_name']}:")
+        if result.get('error_message'):
+            print(f"Error: {result['error_message']}")
+        else:
+            print(f"Original table count: {result['original_count']:,}")
+            print(f"Backup table count: {result['backup_count']:,}")
         print("-" * 50)
 
-        # 결과를 리스트에 추가 (테이블 이름과 레코드 수)
-        results.append({
+# 통계 기반 추정 (원본/백업 테이블 전체를 쿼리 한 번으로 조회)
+def estimate_table_counts(tables, writer, result_f):
+    conn = psycopg2.connect(host=target_host, dbname=target_dbname, user=target_user, password=target_password,
+                            options=connect_options())
+    try:
+        relations = []
+        for schema_name, table_name in tables:
+            relations.append((schema_name, table_name))
+            relations.append((schema_name, f"{table_name}{backup_suffix}"))
+        with instrumentation.phase(None, 'verify'), conn.cursor() as cur:
+            cur.execute(ESTIMATE_QUERY, ([s for s, _ in relations], [t for _, t in relations]))
+            estimates = {(schema_name, table_name): (count, all_visible)
+                         for schema_name, table_name, count, all_visible in cur.fetchall()}
+    finally:
+        conn.close()
+
+    for schema_name, table_name in tables:
+        original_count, original_visible = estimates[(schema_name, table_name)]
+        backup_count, backup_visible = estimates[(schema_name, f"{table_name}{backup_suffix}")]
+        result = {
             'schema_name': schema_name,
             'table_name': table_name,
             'original_count': original_count,
             'backup_count': backup_count,
+            'original_all_visible': original_visible,
+            'backup_all_visible': backup_visible,
+            'count_mode': 'estimate',
+            'check_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if original_count is None or backup_count is None:
+            result['error_message'] = 'table not found or never analyzed'
+        print_result(result)
+        write_result(writer, result_f, result)
+
+# 테이블의 레코드 수를 비교하는 함수 (연결 풀에서 연결을 받아 실행)
+def compare_table_counts(pool, schema_name, table_name):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as target_cur:
+            # 원본 테이블의 레코드 수 조회 (Target DB)
+            target_cur.execute(f"SELECT COUNT(*) FROM {schema_name}.{table_name}")
+            original_count = target_cur.fetchone()[0]
+
+            # 백업 테이블의 레코드 수 조회 (Target DB)
+            backup_table = f"{table_name}{backup_suffix}"
+            target_cur.execute(f"SELECT COUNT(*) FROM {schema_name}.{backup_table}")
+            backup_count = target_cur.fetchone()[0]
+        conn.rollback()
+
+        return {
+            'schema_name': schema_name,
+            'table_name': table_name,
+            'original_count': original_count,
+            'backup_count': backup_count,
+            'count_mode': 'exact',
             'check_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        })
+        }
 
     except Exception as e:
-        print(f"Error comparing {schema_name}.{table_name}: {e}")
-        results.append({
+        conn.rollback()
+        return {
             'schema_name': schema_name,
             'table_name': table_name,
             'original_count': 'ERROR',
             'backup_count': 'ERROR',
+            'count_mode': 'exact',
             'check_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
             'error_message': str(e)
-        })
-        target_conn.rollback()
+        }
+    finally:
+        pool.putconn(conn)
+
+# 테이블 하나의 PK 범위별 (행 수, 행 해시 합) 계산 ({범위 번호: (행 수, 체크섬)})
+# 행 해시는 md5 앞 16자리를 bigint로 바꾼 값이며, 합으로 묶으므로 행 순서와 무관
+def fetch_range_checksums(pool, schema_name, table_name, columns, pk_column, low):
+    columns_str = ", ".join(columns)
+    bucket_expr = f"({pk_column} - %s) / %s" if pk_column else "0"
+    params = (low, checksum_chunk_size) if pk_column else None
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {bucket_expr} AS bucket,
+                       count(*),
+                       sum(('x' || left(md5(ROW({columns_str})::text), 16))::bit(64)::bigint)
+                FROM {schema_name}.{table_name}
+                GROUP BY 1;
+            """, params)
+            checksums = {bucket: (row_count, checksum) for bucket, row_count, checksum in cur.fetchall()}
+        conn.rollback()
+        return checksums
+    finally:
+        pool.putconn(conn)
+
+# 범위 하나의 행별 해시 조회 ({PK: 해시})
+def fetch_row_hashes(pool, schema_name, table_name, columns, pk_column, start, end):
+    columns_str = ", ".join(columns)
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                SELECT {pk_column}, md5(ROW({columns_str})::text)
+                FROM {schema_name}.{table_name}
+                WHERE {pk_column} >= %s AND {pk_column} < %s;
+            """, (start, end))
+            row_hashes = dict(cur.fetchall())
+        conn.rollback()
+        return row_hashes
+    finally:
+        pool.putconn(conn)
+
+# 원본/백업 테이블의 체크섬을 동시에 계산하여 비교하고, 다른 범위만 행 단위로 내려가 차이 나는 PK를 찾음
+def compare_table_checksums(pool, entry, schema_name, table_name):
+    backup_table = f"{table_name}{backup_suffix}"
+    result = {
+        'schema_name': schema_name,
+        'table_name': table_name,
+        'count_mode': 'checksum',
+        'check_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    try:
+        if not entry['exists']:
+            raise ValueError(f"Table {schema_name}.{table_name} does not exist")
+        columns = column_names(entry)
+        pk_column = integer_pk(entry)
 
-# CSV 파일에서 스키마와 테이블 이름 읽기
-for index, row in df.iterrows():
-    schema_name = row.iloc[0]  # 첫 번째 열: 스키마 이름
-    table_name = row.iloc[1]   # 두 번째 열: 테이블 이름
-    compare_table_counts(schema_name, table_name)
+        # 양쪽 최소 PK 중 작은 값을 범위 기준으로 사용 (PK 인덱스로 바로 조회됨)
+        low = 0
+        if pk_column:
+            conn = pool.getconn()
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f"SELECT LEAST((SELECT MIN({pk_column}) FROM {schema_name}.{table_name}), "
+                                f"(SELECT MIN({pk_column}) FROM {schema_name}.{backup_table}));")
+                    low = cur.fetchone()[0] or 0
+                conn.rollback()
+            finally:
+                pool.putconn(conn)
 
-# 결과를 DataFrame으로 변환하고 CSV 파일로 저장
-results_df = pd.DataFrame(results)
-results_df.to_csv(result_file, index=False, encoding='utf-8-sig')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            original_future = executor.submit(fetch_range_checksums, pool, schema_name, table_name, columns, pk_column, low)
+            backup_future = executor.submit(fetch_range_checksums, pool, schema_name, backup_table, columns, pk_column, low)
+            original_checksums = original_future.result()
+            backup_checksums = backup_future.result()
+
+        result['original_count'] = sum(row_count for row_count, _ in original_checksums.values())
+        result['backup_count'] = sum(row_count for row_count, _ in backup_checksums.values())
+        mismatched = sorted(bucket for bucket in original_checksums.keys() | backup_checksums.keys()
+                            if original_checksums.get(bucket) != backup_checksums.get(bucket))
+        result['mismatched_ranges'] = len(mismatched)
+
+        # 다른 범위만 행 단위로 비교
+        differing_keys = []
+        if pk_column:
+            for bucket in mismatched:
+                if len(differing_keys) >= max_reported_keys:
+                    break
+                start = low + bucket * checksum_chunk_size
+                end = start + checksum_chunk_size
+                original_rows = fetch_row_hashes(pool, schema_name, table_name, columns, pk_column, start, end)
+                backup_rows = fetch_row_hashes(pool, schema_name, backup_table, columns, pk_column, start, end)
+                differing_keys.extend(sorted(key for key in original_rows.keys() | backup_rows.keys()
+                                             if original_rows.get(key) != backup_rows.get(key)))
+        result['differing_keys'] = " ".join(str(key) for key in differing_keys[:max_reported_keys])
+        return result
+
+    except Exception as e:
+        result['original_count'] = 'ERROR'
+        result['backup_count'] = 'ERROR'
+        result['error_message'] = str(e)
+        return result
+
+# COUNT(*)를 count_workers개의 연결에서 동시에 실행하고 끝나는 대로 기록
+def exact_table_counts(tables, writer, result_f):
+    pool = ThreadedConnectionPool(1, count_workers, host=target_host, dbname=target_dbname, user=target_user,
+                                  password=target_password, options=connect_options())
+    try:
+        with ThreadPoolExecutor(max_workers=count_workers) as executor:
+            futures = [executor.submit(timed_verify, schema_name, table_name, compare_table_counts,
+                                       pool, schema_name, table_name)
+                       for schema_name, table_name in tables]
+            for future in as_completed(futures):
+                result = future.result()
+                print_result(result)
+                record_metrics(result)
+                write_result(writer, result_f, result)
+    finally:
+        pool.closeall()
+
+# 체크섬 비교를 count_workers개 테이블씩 동시에 실행하고 끝나는 대로 기록
+# 테이블마다 원본/백업을 동시에 조회하므로 연결은 count_workers * 2개까지 사용
+def checksum_table_counts(tables, writer, result_f):
+    pool = ThreadedConnectionPool(1, count_workers * 2, host=target_host, dbname=target_dbname, user=target_user,
+                                  password=target_password, options=connect_options())
+    try:
+        # 원본 테이블의 컬럼/PK 정보를 쿼리 한 번으로 조회
+        conn = pool.getconn()
+        try:
+            with instrumentation.phase(None, 'introspect'):
+                catalog = load_schema_catalog(conn, tables)
+        finally:
+            pool.putconn(conn)
 
-# 연결 종료
-target_cur.close()
-target_conn.close()
+        with ThreadPoolExecutor(max_workers=count_workers) as executor:
+            futures = [executor.submit(timed_verify, schema_name, table_name, compare_table_checksums,
+                                       pool, catalog[f"{schema_name}.{table_name}"], schema_name, table_name)
+                       for schema_name, table_name in tables]
+            for future in as_completed(futures):
+                result = future.result()
+                print_result(result)
+                record_metrics(result)
+                if result.get('mismatched_ranges'):
+                    with print_lock:
+                        print(f"Checksum mismatch in {result['mismatched_ranges']} ranges, keys: {result['differing_keys']}")
+                write_result(writer, result_f, result)
+    finally:
+        pool.closeall()
 
-print(f"\nCount comparison completed. Results saved to {result_file}")
+if __name__ == "__main__":
+    # CSV 파일에서 스키마와 테이블 이름 읽기
+    tables = []
+    for index, row in df.iterrows():
+        schema_name = row.iloc[0]  # 첫 번째 열: 스키마 이름
+        table_name = row.iloc[1]   # 두 번째 열: 테이블 이름
+        tables.append((schema_name, table_name))
 
+    instrumentation.start_run('show_two_table_data_count', metrics_jsonl_file, metrics_prom_file)
+    with open(result_file, 'w', newline='', encoding='utf-8-sig') as result_f:
+        writer = csv.DictWriter(result_f, fieldnames=result_fields)
+        writer.writeheader()
+        if count_mode == 'estimate':
+            estimate_table_counts(tables, writer, result_f)
+        elif count_mode == 'checksum':
+            checksum_table_counts(tables, writer, result_f)
+        else:
+            exact_table_counts(tables, writer, result_f)
+    instrumentation.finish_run()
 
+    print(f"\nCount comparison completed. Results saved to {result_file}")
@@ -1,78 +1,412 @@
-import geopandas as gpd
-from shapely.ops import unary_union
-from shapely.geometry import Polygon, MultiPolygon
-import asyncio
-import os
-
-source_path = "F:/border/source"
-result_path = "F:/border/result"
-output_sql = f"{result_path}/border_full.sql"
-
-codes = ['11', '26', '27', '28', '29', '30', '31', '36', '41', '42', '43', '44', '45', '46', '47', '48', '50']
-
-input_srid = 5186   # 현재 shapefile 좌표계
-output_srid = 4326  # PostGIS 좌표계
-
-# ---------------------------
-# 🟣 구멍(holes) 제거 함수
-# ---------------------------
-def remove_holes(geom):
-    if geom.geom_type == 'Polygon':
-        return Polygon(geom.exterior)  # 내부 구멍 제거
-    elif geom.geom_type == 'MultiPolygon':
-        return MultiPolygon([Polygon(p.exterior) for p in geom.geoms])  # 각각의 폴리곤에 적용
-    else:
-        return geom  # 폴리곤이 아니면 그대로 반환
-
-# ---------------------------
-# 🟣 메인 함수 (SQL + SHP 생성)
-# ---------------------------
-async def generate_full_sql_and_shp(f):
-    # 테이블 생성 쿼리
-    f.write(f"DROP TABLE IF EXISTS border_table;\n\n")
-    f.write(f"CREATE TABLE border_table (\n")
-    f.write(f"    code VARCHAR(10) PRIMARY KEY,\n")
-    f.write(f"    geom geometry(MultiPolygon, {output_srid})\n")
-    f.write(");\n\n")
-
-    for code in codes:
-        input_shp = f"{source_path}/{code}/{code}.shp"
-        gdf = gpd.read_file(input_shp)
-        print(f"▶ {code} shp 읽기 완료")
-
-        # 좌표계 변환
-        gdf = gdf.to_crs(epsg=output_srid)
-
-        # union + hole 제거만
-        merged_geom = unary_union(gdf.geometry)
-        no_hole_geom = remove_holes(merged_geom)
-
-        # shp로 저장
-        merged_gdf = gpd.GeoDataFrame(geometry=[no_hole_geom], crs=output_srid)
-        output_shp = f"{result_path}/{code}.shp"
-        merged_gdf.to_file(output_shp)
-        print(f"✅ {code}.shp 저장 완료")
-
-        # INSERT 쿼리 작성
-        wkt = no_hole_geom.wkt
-        insert_sql = f"INSERT INTO border_table (code, geom) VALUES ('{code}', ST_GeomFromText('{wkt}', {output_srid}));\n"
-        f.write(insert_sql)
-        print(f"✅ {code} INSERT 쿼리 생성 완료")
-
-    # 공간 인덱스
-    f.write(f"\nCREATE INDEX border_table_geom_idx ON border_table USING GIST (geom);\n")
-    print(f"✅ 공간 인덱스 생성 쿼리 추가 완료")
-
-# ---------------------------
-# 🟣 진짜 메인
-# ---------------------------
-async def main():
-    os.makedirs(result_path, exist_ok=True)   # result 폴더 없으면 생성
-    with open(output_sql, "w", encoding="utf-8") as f:
-        await generate_full_sql_and_shp(f)
-
-    print(f"\n💾 SQL: {output_sql} 생성 완료")
-    print(f"💾 SHP: {result_path} 폴더에 합쳐진 shapefile 저장 완료")
-
-if __name__ == "__main__":
-    asyncio.run(main())
+import geopandas as gpd
+import math
+import numpy as np
+import shapely
+from shapely.ops import unary_union
+from shapely.geometry import Polygon, MultiPolygon
+import asyncio
+import glob
+import hashlib
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import psycopg2  # load_to_db = True일 때만 필요
+except ImportError:
+    psycopg2 = None
+
+source_path = "F:/border/source"
+result_path = "F:/border/result"
+output_sql = f"{result_path}/border_full.sql"
+
+codes = ['11', '26', '27', '28', '29', '30', '31', '36', '41', '42', '43', '44', '45', '46', '47', '48', '50']
+
+input_srid = 5186   # 현재 shapefile 좌표계
+output_srid = 4326  # PostGIS 좌표계
+
+max_workers = None  # 지역을 동시에 처리할 프로세스 수 (None이면 CPU 수)
+
+# union 방식
+# 'coverage': 경계를 공유하며 겹치지 않는 행정구역 폴리곤(coverage)은 공유 경계만 지우면 되므로
+#             shapely.coverage_union_all로 합침 (공간적으로 가까운 폴리곤끼리 STR 방식으로 묶어 단계적으로 합침)
+#             coverage가 유효하지 않으면(겹침, 경계 불일치) unary_union으로 대체
+# 'unary': 기존 방식 (unary_union)
+union_method = 'coverage'
+union_group_size = 256  # 한 번에 합칠 폴리곤 수 (0 또는 1이면 전체를 한 번에 합침)
+verify_union = False  # True면 unary_union 결과와 비교하여 차이가 크면 unary_union 결과 사용 (검증용, 느림)
+union_tolerance = 1e-9  # 면적 비교 허용 오차 (결과 면적 대비 비율)
+
+# 단계별 단순화(LOD) 허용 오차 (output_srid 단위, 4326이면 도(degree), 앞에서부터 lod1, lod2, ...)
+# 모든 지역을 하나의 coverage로 함께 단순화하므로 이웃 지역 사이 경계가 같은 선으로 유지됨 (Shapely 2.1 이상 필요)
+# 단계마다 border_table_lod<N> 테이블과 result_path/lod<N>/<code>.shp를 생성 (빈 목록이면 단순화 안 함)
+lod_tolerances = [0.0001, 0.001, 0.01]
+
+# SQL 출력 방식
+# 'copy': COPY ... FROM stdin 블록에 hex EWKB(SRID 포함)로 기록 (WKT 변환/파싱이 없고 좌표 정밀도 손실 없음, psql로 실행)
+# 'insert': 기존 방식 (INSERT ... ST_GeomFromText(WKT))
+sql_output_mode = 'copy'
+
+# 로컬 PostGIS에 바로 적재 (SQL 파일 생성과 함께 테이블을 만들고 COPY로 적재)
+load_to_db = False
+db_host = 'localhost'
+db_name = 'gis_db'
+db_user = 'postgres'
+db_password = 'mysecretpassword'
+
+# 컬럼 형식 출력 (SHP와 함께 생성, 빈 목록이면 생성 안 함, geopandas 1.0 이상 + pyogrio/pyarrow 필요)
+# 'parquet': GeoParquet (bbox 컬럼 포함) → result_path/parquet/border.parquet, <code>.parquet
+# 'fgb': FlatGeobuf (packed R-tree 공간 인덱스 포함) → result_path/fgb/border.fgb, <code>.fgb
+# 전체 지역을 합친 파일(border)과 지역별 파일을 만들고, LOD 단계는 합친 파일(border_lod<N>)만 만듦
+columnar_formats = ['parquet', 'fgb']
+
+# 지역별 union 결과 캐시
+# 지역의 .shp/.shx/.dbf/.prj 내용과 처리 설정(SRID, union 설정)의 sha256이 같으면 읽기/좌표계 변환/union을 건너뛰고
+# 저장된 결과(WKB)를 사용 (LOD 단순화는 모든 지역을 함께 처리하므로 캐시 대상이 아니며 매번 다시 계산)
+cache_dir = f"{result_path}/cache"  # None이면 캐시 사용 안 함
+CACHE_INPUT_EXTENSIONS = ('.shp', '.shx', '.dbf', '.prj')
+
+# 직접 적재할 행 ({테이블 이름: [(code, hex EWKB)]})
+db_rows = {}
+
+# ---------------------------
+# 🟣 구멍(holes) 제거 함수
+# ---------------------------
+def remove_holes(geom):
+    if geom.geom_type == 'Polygon':
+        return Polygon(geom.exterior)  # 내부 구멍 제거
+    elif geom.geom_type == 'MultiPolygon':
+        return MultiPolygon([Polygon(p.exterior) for p in geom.geoms])  # 각각의 폴리곤에 적용
+    else:
+        return geom  # 폴리곤이 아니면 그대로 반환
+
+# ---------------------------
+# 🟣 coverage union 엔진
+# ---------------------------
+# Sort-Tile-Recursive: 중심점 x로 세로 띠를 나누고 띠 안에서 y로 정렬하여 group_size개씩 묶음 (STRtree와 같은 묶음 방식)
+def str_groups(geoms, group_size):
+    # 한 묶음에 2개 이상이어야 단계마다 개수가 줄어듦
+    if group_size < 2 or len(geoms) <= group_size:
+        return [geoms]
+    centroids = shapely.centroid(geoms)
+    xs, ys = shapely.get_x(centroids), shapely.get_y(centroids)
+    group_count = math.ceil(len(geoms) / group_size)
+    slice_size = math.ceil(len(geoms) / math.ceil(math.sqrt(group_count)))
+    order = np.argsort(xs, kind='stable')
+    groups = []
+    for start in range(0, len(order), slice_size):
+        strip = order[start:start + slice_size]
+        strip = strip[np.argsort(ys[strip], kind='stable')]
+        groups.extend(geoms[strip[i:i + group_size]] for i in range(0, len(strip), group_size))
+    return groups
+
+# 가까운 폴리곤끼리 묶어 합치고, 합친 결과를 다시 묶어 하나가 될 때까지 반복
+# (인접한 묶음의 합집합도 경계를 공유하는 coverage이므로 다음 단계에서도 coverage union을 쓸 수 있음)
+def hierarchical_coverage_union(geoms):
+    while len(geoms) > 1:
+        geoms = np.array([shapely.coverage_union_all(group) for group in str_groups(geoms, union_group_size)], dtype=object)
+    return geoms[0]
+
+# coverage 여부 확인 (Shapely 2.1 미만은 coverage_is_valid가 없으므로 결과 면적으로만 확인)
+def coverage_is_valid(geoms):
+    if hasattr(shapely, 'coverage_is_valid'):
+        return bool(shapely.coverage_is_valid(geoms))
+    return None
+
+def relative_difference(geom, reference):
+    if reference.area == 0:
+        return 0.0
+    return geom.symmetric_difference(reference).area / reference.area
+
+# 지역 하나의 폴리곤을 하나로 합침 (coverage union, 불가능하면 unary_union)
+def dissolve(code, geometries):
+    if union_method != 'coverage':
+        return unary_union(geometries)
+
+    geoms = shapely.get_parts(np.asarray(geometries, dtype=object))
+    geoms = geoms[~shapely.is_empty(geoms)]
+    if len(geoms) == 0:
+        print(f"⚠ {code} 유효한 도형이 없음")
+        return MultiPolygon()
+    if coverage_is_valid(geoms) is False:
+        print(f"⚠ {code} coverage가 유효하지 않아 unary_union 사용")
+        return unary_union(geoms)
+
+    merged_geom = hierarchical_coverage_union(geoms)
+    # 겹치는 폴리곤이 있으면 합친 면적이 입력 면적 합보다 작아짐
+    input_area = shapely.area(geoms).sum()
+    if input_area and abs(merged_geom.area - input_area) / input_area > union_tolerance:
+        print(f"⚠ {code} coverage union 면적 불일치, unary_union 사용")
+        return unary_union(geoms)
+
+    if verify_union:
+        reference = unary_union(geoms)
+        difference = relative_difference(merged_geom, reference)
+        if difference > union_tolerance:
+            print(f"⚠ {code} unary_union 결과와 차이 {difference:.2e}, unary_union 결과 사용")
+            return reference
+        print(f"✅ {code} coverage union 검증 완료 (차이 {difference:.2e})")
+    return merged_geom
+
+# ---------------------------
+# 🟣 지역별 결과 캐시
+# ---------------------------
+def region_cache_key(code):
+    digest = hashlib.sha256()
+    params = {
+        'code': code,
+        'input_srid': input_srid,
+        'output_srid': output_srid,
+        'union_method': union_method,
+        'union_group_size': union_group_size,
+        'verify_union': verify_union,
+        'union_tolerance': union_tolerance,
+    }
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    for extension in CACHE_INPUT_EXTENSIONS:
+        path = f"{source_path}/{code}/{code}{extension}"
+        digest.update(extension.encode('utf-8'))
+        if not os.path.exists(path):
+            digest.update(b'missing')
+            continue
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+def cache_file(code, cache_key):
+    return f"{cache_dir}/{code}_{cache_key}.wkb"
+
+def load_cached_region(code, cache_key):
+    path = cache_file(code, cache_key)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return shapely.from_wkb(f.read())
+
+# 같은 지역의 이전 캐시는 지우고 임시 파일에 쓴 뒤 교체 (중간에 중단되어도 깨진 캐시가 남지 않음)
+def save_cached_region(code, cache_key, merged_geom):
+    for old_file in glob.glob(f"{cache_dir}/{code}_*.wkb"):
+        os.remove(old_file)
+    path = cache_file(code, cache_key)
+    with open(f"{path}.tmp", 'wb') as f:
+        f.write(shapely.to_wkb(merged_geom))
+    os.replace(f"{path}.tmp", path)
+
+# ---------------------------
+# 🟣 지역 하나 처리 (프로세스 풀에서 실행: 캐시 확인 → 읽기 → 좌표계 변환 → union → 구멍 제거)
+# 구멍이 있는 union 결과도 함께 반환 (다른 지역을 감싸는 지역은 구멍 경계가 안쪽 지역과의 공유 경계이므로 단순화에 필요)
+# ---------------------------
+def process_region(code):
+    # 입력 파일 해시도 프로세스마다 나눠 계산
+    cache_key = region_cache_key(code) if cache_dir else None
+    if cache_key:
+        merged_geom = load_cached_region(code, cache_key)
+        if merged_geom is not None:
+            print(f"♻ {code} 캐시 사용 (입력/설정 변경 없음)")
+            return merged_geom, remove_holes(merged_geom)
+
+    input_shp = f"{source_path}/{code}/{code}.shp"
+    gdf = gpd.read_file(input_shp)
+    print(f"▶ {code} shp 읽기 완료")
+
+    # 좌표계 변환
+    gdf = gdf.to_crs(epsg=output_srid)
+
+    # union + hole 제거만
+    merged_geom = dissolve(code, gdf.geometry.values)
+    if cache_key:
+        save_cached_region(code, cache_key, merged_geom)
+    return merged_geom, remove_holes(merged_geom)
+
+# ---------------------------
+# 🟣 테이블 생성 / 공간 인덱스 쿼리
+# ---------------------------
+def table_ddl(table_name):
+    return (f"DROP TABLE IF EXISTS {table_name};\n\n"
+            f"CREATE TABLE {table_name} (\n"
+            f"    code VARCHAR(10) PRIMARY KEY,\n"
+            f"    geom geometry(MultiPolygon, {output_srid})\n"
+            ");\n")
+
+def index_ddl(table_name):
+    return f"CREATE INDEX {table_name}_geom_idx ON {table_name} USING GIST (geom);\n"
+
+def copy_statement(table_name):
+    return f"COPY {table_name} (code, geom) FROM stdin;\n"
+
+# copy 모드는 테이블 생성 뒤 바로 COPY 블록을 열고, 마지막 행 뒤에 \. 로 닫음
+def write_table_header(f, table_name):
+    f.write(table_ddl(table_name) + "\n")
+    if sql_output_mode == 'copy':
+        f.write(copy_statement(table_name))
+
+def write_table_footer(f, table_name):
+    if sql_output_mode == 'copy':
+        f.write("\\.\n")
+    f.write(f"\n{index_ddl(table_name)}\n")
+    print(f"✅ {table_name} 공간 인덱스 생성 쿼리 추가 완료")
+
+# geom 컬럼이 MultiPolygon이므로 Polygon은 MultiPolygon으로 변환
+def to_multipolygon(geom):
+    return MultiPolygon([geom]) if geom.geom_type == 'Polygon' else geom
+
+# SRID가 포함된 hex EWKB (PostGIS geometry 입력 형식 그대로)
+def to_hex_ewkb(geom):
+    return shapely.to_wkb(shapely.set_srid(to_multipolygon(geom), output_srid), hex=True, include_srid=True)
+
+# 행 하나 기록 (copy: 탭으로 구분한 COPY 데이터 행, insert: INSERT 문)
+def write_row(f, table_name, code, geom):
+    if sql_output_mode == 'copy' or load_to_db:
+        hex_ewkb = to_hex_ewkb(geom)
+    if sql_output_mode == 'copy':
+        f.write(f"{code}\t{hex_ewkb}\n")
+    else:
+        wkt = to_multipolygon(geom).wkt
+        f.write(f"INSERT INTO {table_name} (code, geom) VALUES ('{code}', ST_GeomFromText('{wkt}', {output_srid}));\n")
+    if load_to_db:
+        db_rows.setdefault(table_name, []).append((code, hex_ewkb))
+
+# ---------------------------
+# 🟣 지역 하나의 결과 기록 (SHP 저장 + COPY 행/INSERT 쿼리 작성)
+# ---------------------------
+def write_region(f, code, no_hole_geom, table_name='border_table', shp_dir=None):
+    # shp로 저장
+    merged_gdf = gpd.GeoDataFrame(geometry=[no_hole_geom], crs=output_srid)
+    output_shp = f"{shp_dir or result_path}/{code}.shp"
+    merged_gdf.to_file(output_shp)
+    print(f"✅ {output_shp} 저장 완료")
+
+    # COPY 행 또는 INSERT 쿼리 작성
+    write_row(f, table_name, code, no_hole_geom)
+    print(f"✅ {code} {table_name} {sql_output_mode.upper()} 행 생성 완료")
+
+# ---------------------------
+# 🟣 GeoParquet / FlatGeobuf 기록
+# ---------------------------
+def write_columnar(name, region_codes, geoms):
+    gdf = gpd.GeoDataFrame({'code': region_codes}, geometry=[to_multipolygon(geom) for geom in geoms], crs=output_srid)
+    for columnar_format in columnar_formats:
+        output_dir = f"{result_path}/{columnar_format}"
+        os.makedirs(output_dir, exist_ok=True)
+        output_file = f"{output_dir}/{name}.{columnar_format}"
+        if columnar_format == 'parquet':
+            gdf.to_parquet(output_file, write_covering_bbox=True)
+        else:
+            gdf.to_file(output_file, driver='FlatGeobuf', engine='pyogrio', SPATIAL_INDEX='YES')
+        print(f"✅ {output_file} 저장 완료")
+
+# 컬럼 형식 결과 읽기 (bbox = (minx, miny, maxx, maxy), output_srid 좌표)
+# GeoParquet은 bbox 컬럼으로 행 그룹을 거르고, FlatGeobuf는 R-tree로 해당 범위의 지역만 Arrow로 읽음
+def read_borders(path, bbox=None):
+    if path.endswith('.parquet'):
+        return gpd.read_parquet(path, bbox=bbox)
+    return gpd.read_file(path, engine='pyogrio', use_arrow=True, bbox=bbox)
+
+# ---------------------------
+# 🟣 로컬 PostGIS에 직접 적재 (테이블마다 생성 → COPY → 공간 인덱스를 한 트랜잭션으로)
+# ---------------------------
+def load_tables_to_db():
+    if psycopg2 is None:
+        print("⚠ psycopg2가 없어 DB 직접 적재를 건너뜀")
+        return
+    conn = psycopg2.connect(host=db_host, dbname=db_name, user=db_user, password=db_password)
+    try:
+        with conn.cursor() as cur:
+            for table_name, rows in db_rows.items():
+                cur.execute(table_ddl(table_name))
+                buffer = io.StringIO("".join(f"{code}\t{hex_ewkb}\n" for code, hex_ewkb in rows))
+                cur.copy_expert(copy_statement(table_name), buffer)
+                cur.execute(index_ddl(table_name))
+                conn.commit()
+                print(f"✅ {table_name} DB 적재 완료 ({len(rows)}행)")
+    finally:
+        conn.close()
+
+# ---------------------------
+# 🟣 단계별 단순화 (LOD)
+# 구멍이 있는 union 결과 전체를 coverage로 보고 coverage_simplify로 공유 경계를 한 번만 단순화한 뒤 구멍 제거
+# (구멍을 먼저 제거하면 감싸는 지역과 안쪽 지역이 겹쳐 coverage가 아니게 됨)
+# ---------------------------
+def simplify_levels(merged_geoms):
+    if not lod_tolerances:
+        return []
+    if not hasattr(shapely, 'coverage_simplify'):
+        print(f"⚠ Shapely {shapely.__version__}에는 coverage_simplify가 없어 단순화를 건너뜀 (2.1 이상 필요)")
+        return []
+    coverage = np.array(merged_geoms, dtype=object)
+    if coverage_is_valid(coverage) is False:
+        print("⚠ 지역 경계가 서로 정확히 맞지 않아 단순화 후 틈이나 겹침이 생길 수 있음")
+    levels = []
+    for level, tolerance in enumerate(lod_tolerances, 1):
+        simplified = shapely.coverage_simplify(coverage, tolerance)
+        levels.append((level, tolerance, [remove_holes(geom) for geom in simplified]))
+    return levels
+
+def write_lod_levels(f, merged_geoms, full_vertex_count):
+    for level, tolerance, geoms in simplify_levels(merged_geoms):
+        table_name = f"border_table_lod{level}"
+        shp_dir = f"{result_path}/lod{level}"
+        os.makedirs(shp_dir, exist_ok=True)
+        write_table_header(f, table_name)
+        for code, geom in zip(codes, geoms):
+            write_region(f, code, geom, table_name, shp_dir)
+        write_table_footer(f, table_name)
+        if columnar_formats:
+            write_columnar(f"border_lod{level}", codes, geoms)
+        vertex_count = int(shapely.get_num_coordinates(np.array(geoms, dtype=object)).sum())
+        print(f"✅ lod{level} (허용 오차 {tolerance}) 꼭짓점 수 {full_vertex_count:,} → {vertex_count:,}")
+
+# ---------------------------
+# 🟣 메인 함수 (SQL + SHP 생성)
+# ---------------------------
+async def generate_full_sql_and_shp(f):
+    # 테이블 생성 쿼리
+    write_table_header(f, 'border_table')
+
+    # 모든 지역을 프로세스 풀에 한 번에 넣고, 결과는 codes 순서대로 기다리며 한 곳에서만 기록
+    # (앞 지역이 끝나는 대로 기록하는 동안 뒤 지역은 다른 프로세스에서 계속 처리되므로
+    #  전체 소요 시간은 가장 오래 걸리는 지역 하나에 가까워지고, 출력 순서는 항상 같음)
+    loop = asyncio.get_running_loop()
+    merged_geoms = []
+    no_hole_geoms = []
+    full_vertex_count = 0
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [loop.run_in_executor(executor, process_region, code) for code in codes]
+        for code, future in zip(codes, futures):
+            merged_geom, no_hole_geom = await future
+            write_region(f, code, no_hole_geom)
+            if columnar_formats:
+                write_columnar(code, [code], [no_hole_geom])
+            merged_geoms.append(merged_geom)
+            no_hole_geoms.append(no_hole_geom)
+            full_vertex_count += int(shapely.get_num_coordinates(no_hole_geom))
+
+    # 공간 인덱스
+    write_table_footer(f, 'border_table')
+
+    # 전체 지역을 합친 GeoParquet / FlatGeobuf
+    if columnar_formats:
+        write_columnar('border', codes, no_hole_geoms)
+
+    # 단계별 단순화 테이블/SHP (모든 지역이 끝난 뒤 한 번에 단순화)
+    write_lod_levels(f, merged_geoms, full_vertex_count)
+
+# ---------------------------
+# 🟣 진짜 메인
+# ---------------------------
+async def main():
+    os.makedirs(result_path, exist_ok=True)   # result 폴더 없으면 생성
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    with open(output_sql, "w", encoding="utf-8") as f:
+        await generate_full_sql_and_shp(f)
+    if load_to_db:
+        load_tables_to_db()
+
+    print(f"\n💾 SQL: {output_sql} 생성 완료")
+    print(f"💾 SHP: {result_path} 폴더에 합쳐진 shapefile 저장 완료")
+
+if __name__ == "__main__":
+    asyncio.run(main())